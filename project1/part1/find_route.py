@@ -1,141 +1,238 @@
 import sys
 import os
+import argparse
+import heapq
+import contextlib
+from route_graph import GraphBuilder, compile_graph, is_compiled, load_graph
+from route_loader import GraphLoader, load_roads, read_lines
 
-# node class
+# node class, city is the city id in the Graph. distance is the road from
+# the parent, g the km from the start and cost the fringe priority (g + h).
 class Node:
-    def __init__(self, city=None, distance=None, cost=None):
+    __slots__ = ("city", "distance", "cost", "g", "parent")
+
+    def __init__(self, city=None, distance=None, cost=None, g=None):
         self.city = city
         self.distance = distance
         self.cost = cost
+        self.g = cost if g is None else g
         self.parent = None
 
-# reads the input file
+# reads the input file into a Graph
+# the file is streamed in chunks (route_loader.py), roads go straight into
+# the builder's arrays
 def read_file(file):
-    lines = dict()
-    with open(file, "r") as f:
-        for line in f.readlines():
-            line = line.strip()
-            if line != "END OF INPUT":
-                line = line.split(" ")
-                if line[0] not in lines:
-                    lines[line[0]] = list()
-                if line[1] not in lines:
-                    lines[line[1]] = list()
-                lines[line[0]].append((line[1], float(line[2])))
-                lines[line[1]].append((line[0], float(line[2])))
-            else:
-                break
-    return lines
+    return load_roads(file, GraphBuilder()).build()
 
 # reads the heuristic file
 def read_heuristic(file):
     lines = dict()
-    with open(file, "r") as f:
-        for line in f.readlines():
-            line = line.strip()
-            if line != "END OF INPUT":
-                line = line.split(" ")
-                lines[line[0]] = float(line[1])
-            else:
-                break
+    for line in read_lines(file):
+        line = line.split(" ")
+        lines[line[0]] = float(line[1])
     return lines
 
+# reads a heuristic file, or maps a heuristic store made by heuristic-build
+# that holds the tables of many goals
+def load_heuristic(file, map):
+    from route_heuristics import is_store, load_store
+    if is_store(file):
+        store = load_store(file)
+        if not store.matches(map):
+            raise ValueError("{0} was not built for this map".format(file))
+        return store
+    return read_heuristic(file)
+
+# opens a route file, text or compiled. Returns the map and the heuristic
+# compiled into it as a (goal id, table) pair, None for text files.
+def load_map(file):
+    file = os.path.realpath(os.path.abspath(file))
+    if is_compiled(file):
+        return load_graph(file)
+    return read_file(file), None
+
+# opens a route file together with a heuristic file. A text route file is
+# parsed on a background thread (GraphLoader) while the heuristic file is
+# read; a heuristic store has to be checked against the map, so it waits
+# for it. Returns the map, the compiled heuristic (see load_map) and the
+# heuristic. With hooks the heuristic read is timed as its own phase, inside
+# the parse phase when the two overlap.
+def load_map_with_heuristic(route, heuristic_file, hooks=None):
+    from route_heuristics import is_store
+    route = os.path.realpath(os.path.abspath(route))
+    heuristic_file = os.path.realpath(os.path.abspath(heuristic_file))
+    if is_compiled(route) or is_store(heuristic_file):
+        with phase(hooks, "parse"):
+            map, compiled_heuristic = load_map(route)
+        with phase(hooks, "heuristic"):
+            heuristic = load_heuristic(heuristic_file, map)
+        return map, compiled_heuristic, heuristic
+    with phase(hooks, "parse"):
+        loader = GraphLoader(route)
+        loader.start()
+        with phase(hooks, "heuristic"):
+            heuristic = read_heuristic(heuristic_file)
+        map = loader.graph()
+    return map, None, heuristic
+
+# turns a city -> value heuristic into a list indexed by city id.
+# Cities missing from the file get 0 which never overestimates.
+# Heuristics that work for any goal (they have a for_goal method) give the
+# table for the goal id, tables already indexed by id are returned as they are.
+def heuristic_table(heuristic, map, goal=None):
+    if not heuristic:
+        return None
+    if hasattr(heuristic, "for_goal"):
+        return heuristic.for_goal(goal, map)
+    if not isinstance(heuristic, dict):
+        return heuristic
+    table = [0.0] * len(map)
+    for city, value in heuristic.items():
+        city = map.city_id(city)
+        if city is not None:
+            table[city] = value
+    return table
+
 # creates a node
-def create_node(city=None, distance=None, cost=None):
-    node = Node(city=city, distance=distance, cost=cost)
+def create_node(city=None, distance=None, cost=None, g=None):
+    node = Node(city=city, distance=distance, cost=cost, g=g)
     return node
 
-# function that does binary search for faster insertion time
-def binary_search(fringe, city_node):
-    l = 0
-    r = len(fringe)-1
+# builds the node chain of a known route. cities are ids and distances[i]
+# is the road from cities[i-1] to cities[i]. Returns the last node, the
+# same thing ucs_search returns for a route.
+def create_chain(cities, distances):
+    tail = None
+    g = 0
+    for i in range(len(cities)):
+        distance = 0
+        if i > 0:
+            distance = distances[i]
+        g += distance
+        node = create_node(city=cities[i], distance=distance, cost=g, g=g)
+        node.parent = tail
+        tail = node
+    return tail
 
-    while(l <= r):
-        mid = int((l+r)/2)
+# heap backed priority queue used as the fringe. A decrease-key leaves the
+# old heap entry behind marked as removed, pop skips those (lazy deletion).
+class Fringe:
+    def __init__(self):
+        self.heap = list()
+        self.entries = dict() # city -> live heap entry
+        self.counter = 0 # insertion order, keeps ties first in first out
+        self.peak = 0 # most nodes waiting at once
 
-        if fringe[mid].cost == city_node.cost:
-            return mid
+    def __len__(self):
+        return len(self.entries)
 
-        if fringe[mid].cost > city_node.cost:
-            l = mid + 1
-        else:
-            r = mid - 1
+    # adds a node to the heap
+    def push(self, city_node):
+        if city_node.city in self.entries:
+            self.entries[city_node.city][2] = None
+        entry = [city_node.cost, self.counter, city_node]
+        self.counter += 1
+        self.entries[city_node.city] = entry
+        heapq.heappush(self.heap, entry)
+        if len(self.entries) > self.peak:
+            self.peak = len(self.entries)
+
+    # returns the node waiting in the fringe for a city, None if there is none
+    def get(self, city):
+        entry = self.entries.get(city)
+        if entry:
+            return entry[2]
+        return None
 
-    return mid
+    # re-queues a node whose cost went down
+    def update(self, city_node):
+        self.push(city_node)
+
+    # returns the lowest cost node without removing it, None when empty
+    def peek(self):
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0][2]
+        return None
+
+    # removes and returns the lowest cost node
+    def pop(self):
+        while self.heap:
+            node = heapq.heappop(self.heap)[2]
+            if node is not None:
+                del self.entries[node.city]
+                return node
+        raise IndexError("pop from empty fringe")
 
 # function that adds a node to the fringe
 def add_to_fringe(city_node, fringe):
-    if len(fringe) > 0:
-        # find the correct index to place in sorted list
-        index = binary_search(fringe, city_node)
-        if(fringe[index].cost > city_node.cost):
-            fringe.insert(index+1, city_node)
-        else:
-            fringe.insert(index, city_node)
-    else:
-        fringe.append(city_node)
+    fringe.push(city_node)
 
 # function that expands a node
 def expand_node(popped, fringe, closed, map, nodes_generated, heuristic):
-    if popped.city in map:
-        for city in map[popped.city]:
-            # modification of UCS to be optimal. Checks if in closed
-            # then replaces the last copy of the node where it is less.
-            if city[0] in closed:
-                index = None
-                i = len(fringe) - 1
-                while(i > 0):
-                    if heuristic:
-                        if fringe[i].city == city[0] and fringe[i].cost > city[1]+heuristic[city[0]]:
-                            index = i
-                    else:
-                        if fringe[i].city == city[0] and fringe[i].cost > city[1]+popped.cost:
-                            index = i
-                    i -= 1
-
-                if index:
-                    fringe[index].parent = popped
-                    if heuristic:
-                        fringe[index].cost = city[1]+heuristic[city[0]]
-                    else:
-                        fringe[index].cost = city[1]+popped.cost
-
-                    # remove from fringe and place it back in the fringe sorted
-                    tmp = fringe[index]
-                    del fringe[index]
-                    add_to_fringe(tmp, fringe)
-            else:
-                nodes_generated += 1
-                if heuristic:
-                    new_node = create_node(city=city[0], distance=city[1], cost=city[1]+heuristic[city[0]])  
-                else:
-                    new_node = create_node(city=city[0], distance=city[1], cost=city[1]+popped.cost)
+    targets = map.targets
+    weights = map.weights
+    for e in range(map.offsets[popped.city], map.offsets[popped.city+1]):
+        city = targets[e]
+        distance = weights[e]
+        g = distance+popped.g
+        if heuristic:
+            cost = g+heuristic[city]
+        else:
+            cost = g
 
-                closed[city[0]] = city[0]
+        # modification of UCS to be optimal. Checks if in closed
+        # then lowers the cost of the copy still in the fringe.
+        if closed[city]:
+            node = fringe.get(city)
+            if node is not None and node.cost > cost:
+                node.parent = popped
+                node.distance = distance
+                node.cost = cost
+                node.g = g
+                fringe.update(node)
+        else:
+            nodes_generated += 1
+            new_node = create_node(city=city, distance=distance, cost=cost, g=g)
+
+            closed[city] = 1
 
-                new_node.parent = popped
+            new_node.parent = popped
 
-                # place in the correct spot in the fringe 
-                add_to_fringe(new_node, fringe)
+            add_to_fringe(new_node, fringe)
     return nodes_generated
 
-# function that initiates the ucs search
-def ucs_search(start, goal, map, heuristic):
-    fringe = list()
-    closed = dict() # dict as check for Node will be significantly faster.
+# function that initiates the ucs search. A caller that wants to look at
+# the fringe afterwards (e.g. its peak size) can pass in an empty one.
+# hooks (route_stats.SearchHooks) supply the fringe and watch the heuristic.
+def ucs_search(start, goal, map, heuristic, fringe=None, hooks=None):
+    if fringe is None:
+        fringe = Fringe() if hooks is None else hooks.new_fringe()
+    closed = bytearray(len(map)) # generated flag per city id
     nodes_expanded = 0
     nodes_generated = 0
 
+    start = map.city_id(start)
+    goal = map.city_id(goal)
+    if start is None:
+        return None, 1, 0
+    # no route between components, nothing to search
+    if goal is None or not map.connected(start, goal):
+        return None, 0, 0
+    heuristic = heuristic_table(heuristic, map, goal)
+    if hooks is not None:
+        heuristic = hooks.watch_heuristic(heuristic)
+
     head = create_node(city=start, distance=0, cost=0)
     # add start to fringe
-    fringe.append(head)
+    add_to_fringe(head, fringe)
 
     while(True):
         if(len(fringe) == 0):
             return None, nodes_expanded, nodes_generated
 
-        # can just pop as the list is sorted due to correct placement.
-        # so no need to search for lowest cost node.
+        # the heap hands back the lowest cost node
         popped = fringe.pop()
 
         nodes_expanded += 1
@@ -147,46 +244,231 @@ def ucs_search(start, goal, map, heuristic):
 
     return popped, nodes_expanded, nodes_generated
 
-# function to print all required information
-def print_info(tail, nodes_expanded, nodes_generated):
-    print("nodes expanded: ", nodes_expanded)
-    print("nodes generated: ", nodes_generated)
+# collects the information print_info prints into a dict, distance is None
+# when there is no route. map turns city ids back into names.
+def route_result(tail, nodes_expanded, nodes_generated, map=None):
+    result = {"nodes_expanded": nodes_expanded, "nodes_generated": nodes_generated,
+              "distance": None, "route": list()}
 
     path_list = list()
     distance = 0
 
     if tail != None:
         while(tail != None):
-            path_list.append((tail.city, tail.distance))
+            if map is not None:
+                path_list.append((map.city_name(tail.city), tail.distance))
+            else:
+                path_list.append((tail.city, tail.distance))
             distance += tail.distance
             tail = tail.parent
 
-        print("distance: {0} km".format(distance))
-
-        print("route:")
+        result["distance"] = distance
         while(len(path_list) > 1):
             popped = path_list.pop()
             popped2 = path_list[-1]
-            print("{0} to {1}, {2} km".format(popped[0], popped2[0], str(popped2[1])))
+            result["route"].append((popped[0], popped2[0], popped2[1]))
+
+    return result
+
+# returns the lines print_info prints for a route_result
+def format_result(result):
+    lines = list()
+    lines.append("nodes expanded:  {0}".format(result["nodes_expanded"]))
+    lines.append("nodes generated:  {0}".format(result["nodes_generated"]))
+
+    if result["distance"] is not None:
+        lines.append("distance: {0} km".format(result["distance"]))
+        lines.append("route:")
+        for step in result["route"]:
+            lines.append("{0} to {1}, {2} km".format(step[0], step[1], str(step[2])))
     else:
-        print("distance: infinity")
-        print("route: ")
-        print("none")
+        lines.append("distance: infinity")
+        lines.append("route: ")
+        lines.append("none")
 
-if __name__ == "__main__":
-    if len(sys.argv) < 4:
+    return "\n".join(lines)
+
+# function to print all required information
+# map turns city ids back into names, without it the ids are printed
+def print_info(tail, nodes_expanded, nodes_generated, map=None):
+    print(format_result(route_result(tail, nodes_expanded, nodes_generated, map)))
+
+# times a part of a query when hooks are attached
+def phase(hooks, name):
+    if hooks is None:
+        return contextlib.nullcontext()
+    return hooks.phase(name)
+
+# returns the city a heuristic was written for, the one it is 0 for
+def heuristic_goal(heuristic, map):
+    goal = None
+    for city, value in heuristic.items():
+        if value == 0 and city in map:
+            goal = city
+    return goal
+
+# compile [route file] [output file] [heuristic file]
+def compile_command(argv):
+    if len(argv) < 2:
+        print("Usage: find_route.py compile [input_file] [output_file] [heuristic_file]")
+        sys.exit(2)
+    map = read_file(os.path.realpath(os.path.abspath(argv[0])))
+    heuristic = None
+    goal = None
+    if len(argv) > 2:
+        heuristic = read_heuristic(os.path.realpath(os.path.abspath(argv[2])))
+        goal = heuristic_goal(heuristic, map)
+        heuristic = heuristic_table(heuristic, map)
+    compile_graph(map, argv[1], heuristic, goal)
+
+def main(argv):
+    if len(argv) > 1 and argv[1] == "compile":
+        compile_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "batch":
+        from route_batch import batch_command
+        batch_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "ch-build":
+        from route_ch import ch_build_command
+        ch_build_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "alt-build":
+        from route_alt import alt_build_command
+        alt_build_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "heuristic-build":
+        from route_heuristics import heuristic_build_command
+        heuristic_build_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "tree":
+        from route_cache import tree_command
+        tree_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "replan":
+        from route_replan import replan_command
+        replan_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "matrix":
+        from route_matrix import matrix_command
+        matrix_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "lookup":
+        from route_matrix import lookup_command
+        lookup_command(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "serve":
+        from route_server import serve_command
+        serve_command(argv[2:])
+        return
+
+    if len(argv) < 4:
         sys.exit(0)
-    route = sys.argv[1]
-    start = sys.argv[2]
-    goal = sys.argv[3]
+    parser = argparse.ArgumentParser(prog="find_route.py")
+    parser.add_argument("route", help="route file, text or compiled")
+    parser.add_argument("start")
+    parser.add_argument("goal")
+    parser.add_argument("heuristic", nargs="?", default=None,
+                        help="heuristic file for the goal, or a heuristic store of many goals")
+    parser.add_argument("--bidirectional", action="store_true",
+                        help="search from start and goal at the same time")
+    parser.add_argument("--ch", metavar="FILE", default=None,
+                        help="answer with a contraction hierarchy made by ch-build")
+    parser.add_argument("--alt", metavar="FILE", default=None,
+                        help="A* with landmark bounds made by alt-build, for any goal")
+    parser.add_argument("--tree", metavar="FILE", default=None,
+                        help="answer from a shortest path tree saved by tree, from the start city")
+    parser.add_argument("--k", type=int, default=None, metavar="N",
+                        help="print the N shortest loopless routes, shortest first")
+    parser.add_argument("--memory-budget", type=int, default=None, metavar="N",
+                        help="IDA* remembering at most N cities, bounded memory for huge maps")
+    parser.add_argument("--stats", choices=("text", "json"), default=None,
+                        help="write phase timings, fringe and memory counters to stderr")
+    args = parser.parse_args(argv[1:])
+    start = args.start
+    goal = args.goal
+
+    hooks = None
+    if args.stats:
+        from route_stats import SearchStats
+        hooks = SearchStats()
+
     heuristic = None
-    if len(sys.argv) == 5:
-        heuristic = sys.argv[4]
-    
-    map = read_file(os.path.realpath(os.path.abspath(route)))
-    if heuristic:
-        heuristic = read_heuristic(os.path.realpath(os.path.abspath(heuristic)))
+    if args.heuristic:
+        try:
+            map, compiled_heuristic, heuristic = load_map_with_heuristic(args.route, args.heuristic, hooks)
+        except ValueError as error:
+            sys.exit(str(error))
+    else:
+        with phase(hooks, "parse"):
+            map, compiled_heuristic = load_map(args.route)
+        with phase(hooks, "heuristic"):
+            if args.alt:
+                from route_alt import load_landmarks
+                heuristic = load_landmarks(args.alt)
+                if not heuristic.matches(map):
+                    sys.exit("{0} was not built for {1}".format(args.alt, args.route))
+            elif compiled_heuristic and compiled_heuristic[0] == map.city_id(goal):
+                heuristic = compiled_heuristic[1]
+
+    # prints the --stats output, the memory peak comes from running search
+    # once more under tracemalloc
+    def report_stats(search):
+        if hooks is not None:
+            from route_stats import print_stats
+            hooks.trace_memory(search)
+            print_stats(hooks, args.stats)
 
-    output, nodes_expanded, nodes_generated = ucs_search(start, goal, map, heuristic)
+    if args.k is not None:
+        from route_search import k_shortest_routes
+        with phase(hooks, "search"):
+            routes = k_shortest_routes(start, goal, map, args.k)
+        if not routes:
+            print_info(None, 0, 0, map)
+        for i, (output, nodes_expanded, nodes_generated) in enumerate(routes):
+            if i > 0:
+                print()
+            print("alternative: ", i+1)
+            print_info(output, nodes_expanded, nodes_generated, map)
+        report_stats(lambda: k_shortest_routes(start, goal, map, args.k))
+        return
 
-    print_info(output, nodes_expanded, nodes_generated)
+    if args.ch:
+        from route_ch import ch_search, load_hierarchy
+        hierarchy = load_hierarchy(args.ch)
+        if not hierarchy.matches(map):
+            sys.exit("{0} was not built for {1}".format(args.ch, args.route))
+    elif args.tree:
+        from route_cache import load_tree, saved_tree_search
+        try:
+            tree = load_tree(args.tree, map)
+        except ValueError as error:
+            sys.exit(str(error))
+        if map.city_id(start) not in (None, tree.source):
+            sys.exit("{0} is a tree from {1}, not {2}".format(args.tree, map.city_name(tree.source), start))
+
+    # the search asked for. Only ucs_search takes hooks; they are None for
+    # the tracemalloc run of --stats, which must not count anything twice.
+    def search(hooks):
+        if args.ch:
+            return ch_search(start, goal, map, hierarchy)
+        if args.tree:
+            return saved_tree_search(start, goal, map, tree)
+        if args.memory_budget is not None:
+            from route_search import ida_search
+            return ida_search(start, goal, map, heuristic, args.memory_budget)
+        if args.bidirectional:
+            from route_search import bidirectional_search
+            return bidirectional_search(start, goal, map, heuristic)
+        return ucs_search(start, goal, map, heuristic, hooks=hooks)
+
+    with phase(hooks, "search"):
+        output, nodes_expanded, nodes_generated = search(hooks)
+
+    with phase(hooks, "path"):
+        result = route_result(output, nodes_expanded, nodes_generated, map)
+    print(format_result(result))
+    report_stats(lambda: search(None))
+
+if __name__ == "__main__":
+    main(sys.argv)
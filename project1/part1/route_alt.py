@@ -0,0 +1,125 @@
+import struct
+import sys
+from array import array
+
+from route_graph import SectionReader, check_header, header_flags
+from route_search import shortest_path_tree
+
+# landmark file: header, then dist float64[k*n] (row l holds the km from
+# landmark l to every city, infinity when unreachable), landmarks int32[k].
+# graph version is Graph.version() of the map the landmarks were picked on.
+ALT_MAGIC = b"RGLM"
+ALT_VERSION = 2
+ALT_HEADER = struct.Struct("<4sHHqqq")
+
+INFINITY = float("inf")
+
+# lower bounds towards one goal from the triangle inequality. For every
+# landmark l, |d(l, goal) - d(l, city)| <= d(city, goal) on an undirected
+# map, so the largest of them is an admissible and consistent heuristic.
+class LandmarkBounds:
+    def __init__(self, landmarks, goal):
+        self.landmarks = landmarks
+        self.goal = goal
+
+    def __getitem__(self, city):
+        n = self.landmarks.size
+        dist = self.landmarks.dist
+        goal = self.goal
+        bound = 0
+        for row in range(0, len(dist), n):
+            to_goal = dist[row+goal]
+            to_city = dist[row+city]
+            if to_goal == INFINITY and to_city == INFINITY:
+                continue
+            if to_goal == INFINITY or to_city == INFINITY:
+                # the landmark reaches one and not the other, no route at all
+                return INFINITY
+            if to_goal > to_city:
+                bound = max(bound, to_goal - to_city)
+            else:
+                bound = max(bound, to_city - to_goal)
+        return bound
+
+# precomputed landmark distance tables. Passed as the heuristic of any
+# search, heuristic_table asks it for the bounds of the query's goal.
+class Landmarks:
+    def __init__(self, landmarks, dist, size, graph_version):
+        self.landmarks = landmarks
+        self.dist = dist
+        self.size = size # number of cities
+        self.graph_version = graph_version
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def for_goal(self, goal, map):
+        if goal is None:
+            return None
+        return LandmarkBounds(self, goal)
+
+    # true if the landmarks were picked on this version of the map
+    def matches(self, map):
+        return self.size == len(map) and self.graph_version == map.version()
+
+# picks landmarks by farthest selection: every new landmark is the city
+# farthest from the ones already picked. Cities no landmark reaches yet (other
+# components) come first so every component gets covered.
+def select_landmarks(map, count):
+    n = len(map)
+    count = min(count, n)
+    landmarks = array("i")
+    dist = array("d")
+    nearest = [INFINITY] * n # km to the closest landmark picked so far
+    city = 0
+    while len(landmarks) < count:
+        landmarks.append(city)
+        tree = shortest_path_tree(city, map)
+        dist.extend(tree.dist)
+
+        for other in range(n):
+            if tree.dist[other] < nearest[other]:
+                nearest[other] = tree.dist[other]
+        city = None
+        farthest = -1
+        for other in range(n):
+            if nearest[other] == 0:
+                continue
+            if nearest[other] == INFINITY:
+                city = other
+                break
+            if nearest[other] > farthest:
+                farthest = nearest[other]
+                city = other
+        if city is None:
+            break
+
+    return Landmarks(landmarks, dist, n, map.version())
+
+# writes landmark tables to disk
+def save_landmarks(landmarks, file):
+    with open(file, "wb") as f:
+        f.write(ALT_HEADER.pack(ALT_MAGIC, ALT_VERSION, header_flags(), landmarks.size, len(landmarks), landmarks.graph_version))
+        f.write(array("d", landmarks.dist).tobytes())
+        f.write(array("i", landmarks.landmarks).tobytes())
+
+# maps a landmark file written by save_landmarks
+def load_landmarks(file):
+    reader = SectionReader(file, ALT_HEADER)
+    magic, version, flags, n, k, graph_version = reader.header
+    check_header(file, magic, version, flags, ALT_MAGIC, (ALT_VERSION,))
+    dist = reader.take("d", k*n)
+    landmarks = reader.take("i", k)
+    return Landmarks(landmarks, dist, n, graph_version)
+
+# alt-build [route file] [output file] [landmark count]
+def alt_build_command(argv):
+    from find_route import load_map
+    if len(argv) < 2:
+        print("Usage: find_route.py alt-build [input_file] [output_file] [landmarks]")
+        sys.exit(2)
+    count = 8
+    if len(argv) > 2:
+        count = int(argv[2])
+    map, compiled_heuristic = load_map(argv[0])
+    save_landmarks(select_landmarks(map, count), argv[1])
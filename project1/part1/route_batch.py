@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import threading
+
+from find_route import format_result, heuristic_goal, load_map, load_map_with_heuristic, route_result, ucs_search
+from route_graph import fork_context
+
+# a loaded map with the heuristic and tree cache its queries use. batch and
+# serve each build one; tree_cache > 0 keeps that many shortest path trees.
+class QueryContext:
+    def __init__(self, route, heuristic_file=None, tree_cache=0):
+        self.compiled_heuristic = None
+        self.heuristic = None
+        self.heuristic_goal = None
+        self.tree_cache = None
+        # the tree cache may be shared by threads (serve), searches are not
+        self.lock = threading.Lock()
+        if tree_cache:
+            from route_cache import TreeCache
+            self.tree_cache = TreeCache(tree_cache)
+        if not heuristic_file:
+            self.map, self.compiled_heuristic = load_map(route)
+        else:
+            self.map, self.compiled_heuristic, self.heuristic = load_map_with_heuristic(route, heuristic_file)
+            if not hasattr(self.heuristic, "for_goal"):
+                self.heuristic_goal = heuristic_goal(self.heuristic, self.map)
+
+    # answers one (start, goal) pair, a query of any other length gets
+    # {"error": message} like a bad request to serve
+    def query(self, pair):
+        if len(pair) != 2:
+            return {"error": "bad query: {0}".format(" ".join(pair))}
+        start, goal = pair
+        map = self.map
+        if self.tree_cache is not None:
+            from route_cache import tree_search
+            with self.lock:
+                output, nodes_expanded, nodes_generated = tree_search(start, goal, map, self.tree_cache)
+        else:
+            # a heuristic file only describes one goal, use it for that goal alone.
+            # a heuristic store picks the table of the goal itself.
+            heuristic = None
+            if self.heuristic and goal == self.heuristic_goal:
+                heuristic = self.heuristic
+            elif hasattr(self.heuristic, "for_goal"):
+                heuristic = self.heuristic
+            elif self.compiled_heuristic and self.compiled_heuristic[0] == map.city_id(goal):
+                heuristic = self.compiled_heuristic[1]
+
+            output, nodes_expanded, nodes_generated = ucs_search(start, goal, map, heuristic)
+        result = route_result(output, nodes_expanded, nodes_generated, map)
+        result["start"] = start
+        result["goal"] = goal
+        return result
+
+# the context of a pool worker. run_batch sets it in the parent before the
+# pool starts, so forked workers inherit it (copy on write, or the same
+# mapped pages for a compiled graph) instead of loading the map again.
+_context = None
+
+# pool initializer, loads the context in workers that did not inherit one
+def _init_worker(route, heuristic_file, tree_cache):
+    global _context
+    if _context is None:
+        _context = QueryContext(route, heuristic_file, tree_cache)
+
+def _query(pair):
+    return _context.query(pair)
+
+# reads "start goal" pairs, one per line, until the end or END OF INPUT.
+# Blank lines are skipped, a line without exactly two names is passed on
+# as it is and answered with an error.
+def read_queries(f):
+    for line in f:
+        line = line.split()
+        if line == ["END", "OF", "INPUT"]:
+            break
+        if line:
+            yield tuple(line)
+
+# answers every query, yielding the results in input order. With more than
+# one worker the queries are spread over a process pool sharing the map.
+# With a tree cache, queries sharing a start are answered from one
+# shortest path tree (the heuristic is not needed then).
+def run_batch(route, queries, workers=None, heuristic_file=None, chunksize=64, tree_cache=0):
+    global _context
+    _context = QueryContext(route, heuristic_file, tree_cache)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        for pair in queries:
+            yield _context.query(pair)
+        return
+
+    with fork_context().Pool(workers, _init_worker, (route, heuristic_file, tree_cache)) as pool:
+        for result in pool.imap(_query, queries, chunksize):
+            yield result
+
+# batch [route file] [query file or - for stdin] [--workers N] [--heuristic file] [--json]
+def batch_command(argv):
+    parser = argparse.ArgumentParser(prog="find_route.py batch",
+                                     description="answer many start/goal queries with one map load")
+    parser.add_argument("route", help="route file, text or compiled")
+    parser.add_argument("queries", nargs="?", default="-", help="file of 'start goal' lines, - for stdin")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default one per cpu")
+    parser.add_argument("--heuristic", default=None,
+                        help="heuristic file, used for queries to its goal, or a heuristic store")
+    parser.add_argument("--json", action="store_true", help="write one JSON object per line")
+    parser.add_argument("--tree-cache", type=int, default=0, metavar="N",
+                        help="answer from up to N cached shortest path trees per worker")
+    args = parser.parse_args(argv)
+
+    if args.queries == "-":
+        f = sys.stdin
+    else:
+        f = open(args.queries, "r")
+
+    try:
+        for result in run_batch(args.route, read_queries(f), args.workers, args.heuristic, tree_cache=args.tree_cache):
+            if args.json:
+                sys.stdout.write(json.dumps(result) + "\n")
+            elif "error" in result:
+                sys.stdout.write("error: {0}\n\n".format(result["error"]))
+            else:
+                sys.stdout.write("query: {0} {1}\n".format(result["start"], result["goal"]))
+                sys.stdout.write(format_result(result) + "\n\n")
+    finally:
+        if f is not sys.stdin:
+            f.close()
@@ -0,0 +1,167 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from find_route import Fringe, read_file, read_heuristic, ucs_search
+
+# Benchmarks ucs_search on generated road maps. Every generator places the
+# cities on a plane and makes each road at least as long as the straight
+# line between its ends, so the straight line distance to the goal written
+# to the heuristic files never overestimates.
+
+# cities on a square grid, roads to the right and down neighbours
+def grid_graph(n, rng):
+    side = max(2, int(math.sqrt(n)))
+    points = [(x, y) for y in range(side) for x in range(side)]
+    roads = list()
+    for y in range(side):
+        for x in range(side):
+            city = y*side + x
+            if x+1 < side:
+                roads.append((city, city+1))
+            if y+1 < side:
+                roads.append((city, city+side))
+    return points, roads
+
+# random geometric graph: uniform points in a square, a road between every
+# pair closer than the radius that gives about six roads per city. Points are
+# bucketed by radius sized cells so only neighbouring cells are compared.
+def geometric_graph(n, rng):
+    side = math.sqrt(n)
+    radius = math.sqrt(6.0 / math.pi)
+    points = [(rng.random()*side, rng.random()*side) for i in range(n)]
+    cells = dict()
+    for city, (x, y) in enumerate(points):
+        cells.setdefault((int(x/radius), int(y/radius)), list()).append(city)
+
+    roads = list()
+    for (cx, cy), cities in cells.items():
+        for dx in (0, 1):
+            for dy in (-1, 0, 1):
+                if dx == 0 and dy < 0:
+                    continue
+                others = cells.get((cx+dx, cy+dy))
+                if not others:
+                    continue
+                same = dx == 0 and dy == 0
+                for i in range(len(cities)):
+                    a = cities[i]
+                    start = i+1 if same else 0
+                    for j in range(start, len(others)):
+                        b = others[j]
+                        if math.dist(points[a], points[b]) <= radius:
+                            roads.append((a, b))
+    return points, roads
+
+# scale free graph by preferential attachment (Barabasi-Albert, two roads
+# per new city), the cities get random positions
+def scale_free_graph(n, rng):
+    side = math.sqrt(n)
+    points = [(rng.random()*side, rng.random()*side) for i in range(n)]
+    roads = [(0, 1), (1, 2), (0, 2)]
+    ends = [0, 1, 1, 2, 0, 2] # every city once per road it has
+    for city in range(3, n):
+        chosen = set()
+        while len(chosen) < 2:
+            chosen.add(ends[rng.randrange(len(ends))])
+        for other in chosen:
+            roads.append((city, other))
+            ends.append(city)
+            ends.append(other)
+    return points, roads
+
+GENERATORS = {"grid": grid_graph, "geometric": geometric_graph, "scalefree": scale_free_graph}
+
+# writes a generated map as a route file, road lengths are the straight
+# line times a random detour factor of 1 to 1.3, rounded up
+def write_route_file(file, points, roads, rng):
+    with open(file, "w") as f:
+        for a, b in roads:
+            distance = math.dist(points[a], points[b]) * (1 + 0.3*rng.random())
+            f.write("c{0} c{1} {2:.3f}\n".format(a, b, math.ceil(distance*1000)/1000))
+        f.write("END OF INPUT\n")
+
+# writes the straight line distance from every city to the goal, rounded down
+# so the file never overestimates
+def write_heuristic_file(file, points, goal):
+    with open(file, "w") as f:
+        for city, point in enumerate(points):
+            f.write("c{0} {1:.3f}\n".format(city, math.floor(math.dist(point, points[goal])*1000)/1000))
+        f.write("END OF INPUT\n")
+
+# generates a map, its query set and the heuristic file of every query goal
+def generate(kind, n, queries, goals, seed, directory):
+    rng = random.Random("{0}-{1}-{2}".format(kind, n, seed))
+    points, roads = GENERATORS[kind](n, rng)
+    route = os.path.join(directory, "{0}_{1}.txt".format(kind, n))
+    write_route_file(route, points, roads, rng)
+
+    pairs = list()
+    heuristics = dict()
+    for i in range(goals):
+        goal = rng.randrange(len(points))
+        heuristics["c{0}".format(goal)] = os.path.join(directory, "{0}_{1}_h_c{2}.txt".format(kind, n, goal))
+        write_heuristic_file(heuristics["c{0}".format(goal)], points, goal)
+        for j in range(queries):
+            pairs.append(("c{0}".format(rng.randrange(len(points))), "c{0}".format(goal)))
+    return route, pairs, heuristics
+
+# runs one query, once timed and once under tracemalloc for the memory peak
+def measure(start, goal, map, heuristic):
+    fringe = Fringe()
+    begin = time.perf_counter()
+    output, nodes_expanded, nodes_generated = ucs_search(start, goal, map, heuristic, fringe)
+    seconds = time.perf_counter() - begin
+
+    tracemalloc.start()
+    ucs_search(start, goal, map, heuristic)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"start": start, "goal": goal, "found": output is not None,
+            "distance": output.g if output is not None else None,
+            "seconds": seconds, "peak_memory": peak_memory, "peak_fringe": fringe.peak,
+            "nodes_expanded": nodes_expanded, "nodes_generated": nodes_generated}
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="route_bench.py", description="benchmark ucs_search and A* on generated maps")
+    parser.add_argument("--sizes", default="1000,10000", help="comma separated city counts, e.g. 1000,100000,1000000")
+    parser.add_argument("--kinds", default="grid,geometric,scalefree", help="comma separated generators")
+    parser.add_argument("--queries", type=int, default=5, help="queries per goal")
+    parser.add_argument("--goals", type=int, default=2, help="goals (heuristic files) per map")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", default="bench_maps", help="where generated maps are written")
+    parser.add_argument("--out", default="bench_results.json", help="results file")
+    parser.add_argument("--label", default="", help="tag stored with the results, e.g. a commit id")
+    args = parser.parse_args(argv[1:])
+
+    os.makedirs(args.dir, exist_ok=True)
+    results = {"label": args.label, "python": platform.python_version(), "seed": args.seed, "runs": list()}
+    for kind in args.kinds.split(","):
+        for n in [int(size) for size in args.sizes.split(",")]:
+            route, pairs, heuristics = generate(kind, n, args.queries, args.goals, args.seed, args.dir)
+            begin = time.perf_counter()
+            map = read_file(route)
+            parse_seconds = time.perf_counter() - begin
+            loaded = dict((goal, read_heuristic(file)) for goal, file in heuristics.items())
+
+            for start, goal in pairs:
+                for mode, heuristic in (("ucs", None), ("astar", loaded[goal])):
+                    run = measure(start, goal, map, heuristic)
+                    run.update({"kind": kind, "cities": len(map), "roads": map.edge_count() // 2,
+                                "parse_seconds": parse_seconds, "mode": mode})
+                    results["runs"].append(run)
+                    print("{0:10} {1:8} {2:6} {3:>8} -> {4:<8} {5:9.4f}s expanded {6}".format(
+                        kind, len(map), mode, start, goal, run["seconds"], run["nodes_expanded"]))
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main(sys.argv)
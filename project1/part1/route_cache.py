@@ -0,0 +1,109 @@
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+
+from find_route import create_node, load_map
+from route_graph import SectionReader, check_header, header_flags
+from route_search import ShortestPathTree, shortest_path_tree
+
+# shortest path tree file: header, then dist float64[n], road float64[n],
+# parent int64[n]. graph version is Graph.version() of the map it came from.
+TREE_MAGIC = b"RGTR"
+TREE_VERSION = 1
+TREE_HEADER = struct.Struct("<4sHHqqq")
+
+# bounded least recently used cache of shortest path trees, keyed by source
+# city and graph version so a tree is never served for a changed map
+class TreeCache:
+    def __init__(self, capacity=16):
+        self.capacity = capacity
+        self.trees = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.trees)
+
+    # the tree of a source city id and whether it came from the cache
+    def tree(self, source, map):
+        key = (source, map.version())
+        tree = self.trees.get(key)
+        if tree is not None:
+            self.hits += 1
+            self.trees.move_to_end(key)
+            return tree, True
+
+        self.misses += 1
+        tree = shortest_path_tree(source, map)
+        self.trees[key] = tree
+        if len(self.trees) > self.capacity:
+            self.trees.popitem(last=False)
+        return tree, False
+
+# answers a query from the start city's tree. A cached tree costs no search,
+# so a hit reports no nodes, a miss reports the counters of the tree's run.
+def tree_search(start, goal, map, cache):
+    start = map.city_id(start)
+    goal = map.city_id(goal)
+    if start is None:
+        return None, 1, 0
+    if goal is None or not map.connected(start, goal):
+        return None, 0, 0
+    if start == goal:
+        return create_node(city=start, distance=0, cost=0), 1, 0
+
+    tree, cached = cache.tree(start, map)
+    if cached:
+        return tree.route(goal), 0, 0
+    return tree.route(goal), tree.nodes_expanded, tree.nodes_generated
+
+# answers a query from a tree read by load_tree, the tree's source has to be
+# the start city. Nothing is searched, so no nodes are reported.
+def saved_tree_search(start, goal, map, tree):
+    goal = map.city_id(goal)
+    if map.city_id(start) is None:
+        return None, 1, 0
+    if goal is None:
+        return None, 0, 0
+    return tree.route(goal), 0, 0
+
+# writes a tree to disk
+def save_tree(tree, map, file):
+    with open(file, "wb") as f:
+        f.write(TREE_HEADER.pack(TREE_MAGIC, TREE_VERSION, header_flags(), len(map), tree.source, map.version()))
+        f.write(array("d", tree.dist).tobytes())
+        f.write(array("d", tree.road).tobytes())
+        f.write(array("q", tree.parent).tobytes())
+
+# maps a tree file, refusing one made from another version of the map
+def load_tree(file, map):
+    reader = SectionReader(file, TREE_HEADER)
+    magic, version, flags, n, source, graph_version = reader.header
+    check_header(file, magic, version, flags, TREE_MAGIC, (TREE_VERSION,))
+    if n != len(map) or graph_version != map.version():
+        raise ValueError("{0} was made from another version of the map".format(file))
+    dist = reader.take("d", n)
+    road = reader.take("d", n)
+    parent = reader.take("q", n)
+    return ShortestPathTree(source, dist, parent, road, 0, 0)
+
+# tree [route file] [source] [output file]
+# prints the km from the source to every city it reaches, and saves the tree
+def tree_command(argv):
+    if len(argv) < 2:
+        print("Usage: find_route.py tree [input_file] [source] [output_file]")
+        sys.exit(2)
+    map, compiled_heuristic = load_map(argv[0])
+    source = map.city_id(argv[1])
+    if source is None:
+        sys.exit("{0} is not on the map".format(argv[1]))
+
+    tree = shortest_path_tree(source, map)
+    print("nodes expanded: ", tree.nodes_expanded)
+    print("nodes generated: ", tree.nodes_generated)
+    for city in range(len(map)):
+        if tree.dist[city] != float("inf"):
+            print("{0} {1} km".format(map.city_name(city), tree.dist[city]))
+    if len(argv) > 2:
+        save_tree(tree, map, argv[2])
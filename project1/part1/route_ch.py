@@ -0,0 +1,269 @@
+import heapq
+import struct
+import sys
+from array import array
+
+from find_route import create_chain, create_node
+from route_graph import SectionReader, check_header, header_flags
+
+# contraction hierarchy file: header, then
+#   up offsets int64[n+1], up weights float64[m], rank int32[n],
+#   up targets int32[m], up middles int32[m]
+# graph version is Graph.version() of the map it was built for.
+# the up edges of a city lead to its higher ranked neighbours. middle is the
+# city a shortcut was made over, -1 for a road of the original map.
+CH_MAGIC = b"RGCH"
+CH_VERSION = 2
+CH_HEADER = struct.Struct("<4sHHqqq")
+
+# witness searches give up after settling this many cities. Giving up early
+# only costs an unneeded shortcut, never a wrong distance.
+WITNESS_LIMIT = 500
+
+INFINITY = float("inf")
+
+# node ordering plus the shortcut edges, stored as an upward CSR graph
+class Hierarchy:
+    def __init__(self, rank, offsets, targets, weights, middles, graph_version):
+        self.rank = rank
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.middles = middles
+        self.graph_version = graph_version
+
+    def __len__(self):
+        return len(self.rank)
+
+    # the (weight, middle) of the up edge joining two cities
+    def edge(self, a, b):
+        if self.rank[a] > self.rank[b]:
+            a, b = b, a
+        for e in range(self.offsets[a], self.offsets[a+1]):
+            if self.targets[e] == b:
+                return self.weights[e], self.middles[e]
+        raise KeyError((a, b))
+
+    # true if the hierarchy was built for this version of the map
+    def matches(self, map):
+        return len(self) == len(map) and self.graph_version == map.version()
+
+# cheapest distances from source to the targets without passing through
+# skip, over the cities not contracted yet. Stops early once every target is
+# settled, the bound is passed or the settle limit is hit.
+def witness_search(adjacency, source, skip, targets, bound):
+    dist = {source: 0}
+    heap = [(0, source)]
+    left = set(targets)
+    settled = 0
+    while heap and left and settled < WITNESS_LIMIT:
+        d, city = heapq.heappop(heap)
+        if d > dist[city]:
+            continue
+        if d > bound:
+            break
+        left.discard(city)
+        settled += 1
+        for neighbor, (weight, middle) in adjacency[city].items():
+            if neighbor == skip:
+                continue
+            if d + weight < dist.get(neighbor, INFINITY):
+                dist[neighbor] = d + weight
+                heapq.heappush(heap, (d + weight, neighbor))
+    return dist
+
+# shortcuts needed when city is contracted, as (u, w, weight), each pair once
+def find_shortcuts(adjacency, city):
+    shortcuts = list()
+    neighbors = list(adjacency[city].items())
+    for i in range(len(neighbors)):
+        u, (weight_u, middle_u) = neighbors[i]
+        targets = [neighbors[j][0] for j in range(i+1, len(neighbors))]
+        if not targets:
+            continue
+        bound = weight_u + max(adjacency[city][w][0] for w in targets)
+        dist = witness_search(adjacency, u, city, targets, bound)
+        for w in targets:
+            via = weight_u + adjacency[city][w][0]
+            if dist.get(w, INFINITY) > via:
+                shortcuts.append((u, w, via))
+    return shortcuts
+
+# ordering priority: edge difference plus the neighbours already contracted
+def contraction_priority(adjacency, city, deleted):
+    return len(find_shortcuts(adjacency, city)) - len(adjacency[city]) + deleted[city]
+
+# contracts the cities of a map one at a time, in order of edge difference
+# (updated lazily), adding a shortcut wherever a contracted city was the only
+# shortest way between two of its neighbours.
+def build_hierarchy(map):
+    n = len(map)
+    adjacency = [dict() for i in range(n)] # city -> {neighbour: (weight, middle)}
+    for city in range(n):
+        for neighbor, weight in map.neighbors(city):
+            if neighbor != city and weight < adjacency[city].get(neighbor, (INFINITY,))[0]:
+                adjacency[city][neighbor] = (weight, -1)
+
+    deleted = [0] * n
+    heap = [(contraction_priority(adjacency, city, deleted), city) for city in range(n)]
+    heapq.heapify(heap)
+    rank = array("i", [0] * n)
+    up = [None] * n
+    order = 0
+
+    while heap:
+        priority, city = heapq.heappop(heap)
+        # lazy update, push back if the city got more expensive to contract
+        priority = contraction_priority(adjacency, city, deleted)
+        if heap and priority > heap[0][0]:
+            heapq.heappush(heap, (priority, city))
+            continue
+
+        for u, w, weight in find_shortcuts(adjacency, city):
+            if weight < adjacency[u].get(w, (INFINITY,))[0]:
+                adjacency[u][w] = (weight, city)
+                adjacency[w][u] = (weight, city)
+
+        rank[city] = order
+        order += 1
+        up[city] = adjacency[city]
+        for neighbor in up[city]:
+            del adjacency[neighbor][city]
+            deleted[neighbor] += 1
+        adjacency[city] = dict()
+
+    offsets = array("q", [0])
+    targets = array("i")
+    weights = array("d")
+    middles = array("i")
+    for city in range(n):
+        for neighbor, (weight, middle) in up[city].items():
+            targets.append(neighbor)
+            weights.append(weight)
+            middles.append(middle)
+        offsets.append(len(targets))
+
+    return Hierarchy(rank, offsets, targets, weights, middles, map.version())
+
+# writes a hierarchy to disk
+def save_hierarchy(hierarchy, file):
+    with open(file, "wb") as f:
+        f.write(CH_HEADER.pack(CH_MAGIC, CH_VERSION, header_flags(), len(hierarchy), len(hierarchy.targets), hierarchy.graph_version))
+        f.write(array("q", hierarchy.offsets).tobytes())
+        f.write(array("d", hierarchy.weights).tobytes())
+        f.write(array("i", hierarchy.rank).tobytes())
+        f.write(array("i", hierarchy.targets).tobytes())
+        f.write(array("i", hierarchy.middles).tobytes())
+
+# maps a hierarchy file written by save_hierarchy
+def load_hierarchy(file):
+    reader = SectionReader(file, CH_HEADER)
+    magic, version, flags, n, m, graph_version = reader.header
+    check_header(file, magic, version, flags, CH_MAGIC, (CH_VERSION,))
+    offsets = reader.take("q", n+1)
+    weights = reader.take("d", m)
+    rank = reader.take("i", n)
+    targets = reader.take("i", m)
+    middles = reader.take("i", m)
+    return Hierarchy(rank, offsets, targets, weights, middles, graph_version)
+
+# expands the up edges of a route back into roads of the original map
+def unpack_route(hierarchy, cities, weights):
+    route = [cities[0]]
+    distances = [0]
+    for i in range(1, len(cities)):
+        stack = [(cities[i-1], cities[i], weights[i])]
+        while stack:
+            a, b, weight = stack.pop()
+            middle = hierarchy.edge(a, b)[1]
+            if middle == -1:
+                route.append(b)
+                distances.append(weight)
+            else:
+                # the a -> middle half comes first, so it is pushed last
+                stack.append((middle, b, hierarchy.edge(middle, b)[0]))
+                stack.append((a, middle, hierarchy.edge(a, middle)[0]))
+    return route, distances
+
+# one side of a hierarchy query, Dijkstra over the up edges only
+def upward_step(hierarchy, heap, dist, parent, other, best, nodes_generated):
+    d, city = heapq.heappop(heap)
+    if d > dist[city]:
+        return nodes_generated, False
+    if city in other and d + other[city] < best[0]:
+        best[0] = d + other[city]
+        best[1] = city
+    for e in range(hierarchy.offsets[city], hierarchy.offsets[city+1]):
+        neighbor = hierarchy.targets[e]
+        weight = hierarchy.weights[e]
+        if d + weight < dist.get(neighbor, INFINITY):
+            if neighbor not in dist:
+                nodes_generated += 1
+            dist[neighbor] = d + weight
+            parent[neighbor] = (city, weight)
+            heapq.heappush(heap, (d + weight, neighbor))
+    return nodes_generated, True
+
+# answers a query with the hierarchy: both sides only climb to higher ranked
+# cities and meet at the top of the shortest path. A side stops once its
+# smallest key is no better than the best meeting. The route is unpacked
+# into original roads and returned as a node chain like ucs_search.
+def ch_search(start, goal, map, hierarchy):
+    start = map.city_id(start)
+    goal = map.city_id(goal)
+    if start is None or goal is None:
+        return None, 1, 0
+    if start == goal:
+        return create_node(city=start, distance=0, cost=0), 1, 0
+    if not map.connected(start, goal):
+        return None, 0, 0
+
+    forward = ({start: 0}, {start: None}, [(0, start)])
+    backward = ({goal: 0}, {goal: None}, [(0, goal)])
+    best = [INFINITY, None]
+    nodes_expanded = 0
+    nodes_generated = 0
+
+    sides = [(forward, backward), (backward, forward)]
+    turn = 0
+    while True:
+        live = [side for side in sides if side[0][2] and side[0][2][0][0] < best[0]]
+        if not live:
+            break
+        (dist, parent, heap), other = live[turn % len(live)]
+        turn += 1
+        nodes_generated, expanded = upward_step(hierarchy, heap, dist, parent, other[0], best, nodes_generated)
+        if expanded:
+            nodes_expanded += 1
+
+    if best[1] is None:
+        return None, nodes_expanded, nodes_generated
+
+    # up path start -> meet, then meet -> goal
+    cities = list()
+    weights = list()
+    city = best[1]
+    while city is not None:
+        cities.append(city)
+        step = forward[1][city]
+        weights.append(step[1] if step else 0)
+        city = step[0] if step else None
+    cities.reverse()
+    weights.reverse()
+    city = best[1]
+    while backward[1][city] is not None:
+        city, weight = backward[1][city]
+        cities.append(city)
+        weights.append(weight)
+
+    cities, distances = unpack_route(hierarchy, cities, weights)
+    return create_chain(cities, distances), nodes_expanded, nodes_generated
+
+# ch-build [route file] [output file]
+def ch_build_command(argv):
+    from find_route import load_map
+    if len(argv) < 2:
+        print("Usage: find_route.py ch-build [input_file] [output_file]")
+        sys.exit(2)
+    map, compiled_heuristic = load_map(argv[0])
+    save_hierarchy(build_hierarchy(map), argv[1])
@@ -0,0 +1,355 @@
+import mmap
+import multiprocessing
+import struct
+import sys
+import zlib
+from array import array
+
+# compiled graph file: header, then the sections in this order
+#   offsets int64[n+1], weights float64[m], heuristic float64[n] (optional),
+#   name offsets int64[n+1], targets int32[m], sorted ids int32[n],
+#   components int32[n] (version 2 on), names utf-8
+# the 8 byte sections come first so every section stays aligned.
+GRAPH_MAGIC = b"RGRF"
+GRAPH_VERSION = 2
+GRAPH_HEADER = struct.Struct("<4sHHqqq")
+FLAG_HEURISTIC = 1
+FLAG_BIG_ENDIAN = 2
+
+# road map stored in compressed sparse row form. Cities are interned to
+# integer ids, the roads leaving city i are the entries
+# offsets[i]..offsets[i+1] of targets (neighbour id) and weights (km).
+class Graph:
+    __slots__ = ("names", "ids", "offsets", "targets", "weights", "components", "checksum")
+
+    def __init__(self, names, ids, offsets, targets, weights, components=None):
+        self.names = names # id -> city name
+        self.ids = ids # city name -> id
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        # connected component label per city id
+        if components is None:
+            components = connected_components(self)
+        self.components = components
+        self.checksum = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    # returns the id of a city, None if the city is not on the map
+    def city_id(self, name):
+        return self.ids.get(name)
+
+    # returns the name of a city id
+    def city_name(self, city):
+        return self.names[city]
+
+    # returns the (neighbour id, km) pairs of a city id
+    def neighbors(self, city):
+        targets = self.targets
+        weights = self.weights
+        return [(targets[e], weights[e]) for e in range(self.offsets[city], self.offsets[city+1])]
+
+    # number of directed road entries, every road is stored both ways
+    def edge_count(self):
+        return len(self.targets)
+
+    # checksum of the road arrays, identifies this version of the map for
+    # anything cached from it. Worked out on first use.
+    def version(self):
+        if self.checksum is None:
+            checksum = 0
+            for part in (self.offsets, self.targets, self.weights):
+                checksum = zlib.crc32(array("q", part).tobytes() if part.itemsize != 8 else part, checksum)
+            self.checksum = checksum
+        return self.checksum
+
+    # true if there is any route between two city ids
+    def connected(self, city1, city2):
+        return self.components[city1] == self.components[city2]
+
+# labels the connected components of a graph by breadth first search over
+# its CSR arrays, used for graphs that were not built with a GraphBuilder
+def connected_components(graph):
+    n = len(graph.offsets) - 1
+    components = array("i", [-1]) * n
+    label = 0
+    for root in range(n):
+        if components[root] != -1:
+            continue
+        components[root] = label
+        queue = [root]
+        for city in queue:
+            for e in range(graph.offsets[city], graph.offsets[city+1]):
+                neighbor = graph.targets[e]
+                if components[neighbor] == -1:
+                    components[neighbor] = label
+                    queue.append(neighbor)
+        label += 1
+    return components
+
+# union-find over city ids that stays current as cities and roads are added
+class DynamicComponents:
+    def __init__(self, size=0):
+        self.parent = array("q", range(size))
+        self.size = array("q", [1]) * size
+
+    def __len__(self):
+        return len(self.parent)
+
+    # adds a city on its own, returns its id
+    def add_city(self):
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    # root of a city's set, halving the path on the way up
+    def find(self, city):
+        parent = self.parent
+        while parent[city] != city:
+            parent[city] = parent[parent[city]]
+            city = parent[city]
+        return city
+
+    # joins the sets of the two ends of a road, the smaller under the larger
+    def add_road(self, city1, city2):
+        a = self.find(city1)
+        b = self.find(city2)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+    def connected(self, city1, city2):
+        return self.find(city1) == self.find(city2)
+
+    # compact component labels 0..k-1 per city id
+    def labels(self):
+        roots = dict()
+        components = array("i")
+        for city in range(len(self.parent)):
+            components.append(roots.setdefault(self.find(city), len(roots)))
+        return components
+
+    # union-find over the roads of an existing graph
+    @classmethod
+    def from_graph(cls, graph):
+        components = cls(len(graph))
+        for city in range(len(graph)):
+            for e in range(graph.offsets[city], graph.offsets[city+1]):
+                components.add_road(city, graph.targets[e])
+        return components
+
+# collects roads while a route file is read and packs them into a Graph
+class GraphBuilder:
+    def __init__(self):
+        self.names = list()
+        self.ids = dict()
+        # int32 ids, like the compiled file, to keep the peak of build() down
+        self.sources = array("i")
+        self.destinations = array("i")
+        self.weights = array("d")
+        self.components = DynamicComponents()
+
+    # returns the id of a city, giving it the next free id when first seen
+    def intern(self, name):
+        city = self.ids.get(name)
+        if city is None:
+            city = len(self.names)
+            self.ids[name] = city
+            self.names.append(name)
+            self.components.add_city()
+        return city
+
+    # adds an undirected road
+    def add_road(self, city1, city2, distance):
+        a = self.intern(city1)
+        b = self.intern(city2)
+        self.sources.append(a)
+        self.destinations.append(b)
+        self.weights.append(distance)
+        self.components.add_road(a, b)
+
+    # counting sort of the roads by source city. Stable, so every city keeps
+    # its roads in the order they appear in the file.
+    def build(self):
+        n = len(self.names)
+        offsets = array("q", bytes(8 * (n+1)))
+        for i in range(len(self.sources)):
+            offsets[self.sources[i]+1] += 1
+            offsets[self.destinations[i]+1] += 1
+        for i in range(n):
+            offsets[i+1] += offsets[i]
+
+        m = offsets[n]
+        targets = array("i", bytes(4 * m))
+        weights = array("d", bytes(8 * m))
+        fill = array("q", offsets[:n])
+        for i in range(len(self.sources)):
+            a = self.sources[i]
+            b = self.destinations[i]
+            w = self.weights[i]
+            targets[fill[a]] = b
+            weights[fill[a]] = w
+            fill[a] += 1
+            targets[fill[b]] = a
+            weights[fill[b]] = w
+            fill[b] += 1
+
+        return Graph(self.names, self.ids, offsets, targets, weights, self.components.labels())
+
+# city names of a compiled graph, decoded from the mapped file on access
+class NameTable:
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, city):
+        return self.encoded(city).decode("utf-8")
+
+    def encoded(self, city):
+        return bytes(self.blob[self.offsets[city]:self.offsets[city+1]])
+
+# name -> id lookup of a compiled graph, binary search over the ids sorted
+# by name so nothing has to be built when the file is opened
+class NameIndex:
+    def __init__(self, names, order):
+        self.names = names
+        self.order = order
+
+    def get(self, name, default=None):
+        key = name.encode("utf-8")
+        l = 0
+        r = len(self.order) - 1
+        while l <= r:
+            mid = (l+r) // 2
+            city = self.order[mid]
+            found = self.names.encoded(city)
+            if found == key:
+                return city
+            if found < key:
+                l = mid + 1
+            else:
+                r = mid - 1
+        return default
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+# reads consecutive typed sections out of a memory mapped file. Each
+# section is a memoryview cast over the mapping, nothing is copied.
+class SectionReader:
+    def __init__(self, file, header):
+        with open(file, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.data)
+        self.header = header.unpack_from(self.data, 0)
+        self.position = header.size
+
+    # the next count items of a struct format character
+    def take(self, fmt, count):
+        size = struct.calcsize(fmt) * count
+        part = self.view[self.position:self.position+size].cast(fmt)
+        self.position += size
+        return part
+
+    # the next size raw bytes
+    def take_bytes(self, size):
+        part = self.view[self.position:self.position+size]
+        self.position += size
+        return part
+
+# checks the magic, version and byte order fields of a mapped file header.
+# versions is the tuple of format versions the caller can read.
+def check_header(file, magic, version, flags, expected_magic, versions):
+    if magic != expected_magic:
+        raise ValueError("{0} is not a {1} file".format(file, expected_magic.decode("ascii")))
+    if version not in versions:
+        raise ValueError("{0} has format version {1}, expected {2}".format(file, version, versions[-1]))
+    if bool(flags & FLAG_BIG_ENDIAN) != (sys.byteorder == "big"):
+        raise ValueError("{0} was written on a machine with the other byte order".format(file))
+
+# flags field of a mapped file header, marks the byte order of this machine
+def header_flags(flags=0):
+    if sys.byteorder == "big":
+        flags |= FLAG_BIG_ENDIAN
+    return flags
+
+# encodes the city names of a map for a NameTable and NameIndex. Returns the
+# name offsets int64[n+1], the ids sorted by name int32[n] and the utf-8 names.
+def encode_names(map):
+    encoded = [map.city_name(city).encode("utf-8") for city in range(len(map))]
+    name_offsets = array("q", [0])
+    for name in encoded:
+        name_offsets.append(name_offsets[-1] + len(name))
+    order = array("i", sorted(range(len(map)), key=lambda city: encoded[city]))
+    return name_offsets, order, b"".join(encoded)
+
+# process pool context, fork where the platform has it so workers inherit
+# what the parent already loaded
+def fork_context():
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+# true if the file starts with the compiled graph magic
+def is_compiled(file):
+    with open(file, "rb") as f:
+        return f.read(len(GRAPH_MAGIC)) == GRAPH_MAGIC
+
+# writes a graph, and optionally the heuristic of one goal, as a compiled graph file
+def compile_graph(graph, file, heuristic=None, heuristic_goal=None):
+    n = len(graph)
+    m = graph.edge_count()
+    flags = header_flags()
+    if heuristic:
+        flags |= FLAG_HEURISTIC
+    goal = -1
+    if heuristic_goal is not None:
+        goal = graph.city_id(heuristic_goal)
+    name_offsets, order, names = encode_names(graph)
+
+    with open(file, "wb") as f:
+        f.write(GRAPH_HEADER.pack(GRAPH_MAGIC, GRAPH_VERSION, flags, goal, n, m))
+        f.write(array("q", graph.offsets).tobytes())
+        f.write(array("d", graph.weights).tobytes())
+        if heuristic:
+            f.write(array("d", heuristic).tobytes())
+        f.write(name_offsets.tobytes())
+        f.write(array("i", graph.targets).tobytes())
+        f.write(order.tobytes())
+        f.write(array("i", graph.components).tobytes())
+        f.write(names)
+
+# maps a compiled graph file. The arrays of the returned Graph are views
+# straight into the mapping, nothing is parsed. Returns the graph and a
+# (goal id, heuristic table) pair or None when no heuristic was compiled in.
+def load_graph(file):
+    reader = SectionReader(file, GRAPH_HEADER)
+    magic, version, flags, goal, n, m = reader.header
+    check_header(file, magic, version, flags, GRAPH_MAGIC, (1, GRAPH_VERSION))
+
+    offsets = reader.take("q", n+1)
+    weights = reader.take("d", m)
+    heuristic = None
+    if flags & FLAG_HEURISTIC:
+        heuristic = (goal, reader.take("d", n))
+    name_offsets = reader.take("q", n+1)
+    targets = reader.take("i", m)
+    order = reader.take("i", n)
+    # version 1 files have no component index, it is worked out on load
+    components = None
+    if version >= 2:
+        components = reader.take("i", n)
+    names = NameTable(name_offsets, reader.take_bytes(name_offsets[n]))
+
+    return Graph(names, NameIndex(names, order), offsets, targets, weights, components), heuristic
@@ -0,0 +1,107 @@
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from route_graph import SectionReader, check_header, header_flags
+
+# heuristic store file: header, then tables float64[k*n] (row i holds the
+# estimate of every city towards goal i, by city id of the map), goals
+# int32[k]. graph version is Graph.version() of the map it was built for.
+STORE_MAGIC = b"RGHS"
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct("<4sHHqqq")
+
+# heuristic tables of many goals in one mapped file. Passed as the
+# heuristic of any search, heuristic_table asks it for the query's goal:
+# the row is copied out of the mapping the first time a goal is asked for
+# and kept in a least recently used cache of hot goals. Goals without a
+# table get None, so the search runs as plain UCS.
+class HeuristicStore:
+    def __init__(self, tables, goals, size, graph_version, capacity=64):
+        self.tables = tables
+        self.rows = dict((goal, row) for row, goal in enumerate(goals)) # goal id -> row
+        self.size = size # number of cities
+        self.graph_version = graph_version
+        self.capacity = capacity
+        self.loaded = OrderedDict() # goal id -> table
+        # serve shares one store between its query threads
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, goal):
+        return goal in self.rows
+
+    def for_goal(self, goal, map):
+        with self.lock:
+            table = self.loaded.get(goal)
+            if table is not None:
+                self.hits += 1
+                self.loaded.move_to_end(goal)
+                return table
+            row = self.rows.get(goal)
+            if row is None:
+                return None
+
+            self.misses += 1
+            table = array("d", self.tables[row*self.size:(row+1)*self.size])
+            self.loaded[goal] = table
+            if len(self.loaded) > self.capacity:
+                self.loaded.popitem(last=False)
+            return table
+
+    # true if the store was built for this version of the map
+    def matches(self, map):
+        return self.size == len(map) and self.graph_version == map.version()
+
+# writes the heuristic tables of several goals. tables maps a goal city id
+# to its table indexed by city id (see heuristic_table).
+def save_store(tables, map, file):
+    n = len(map)
+    goals = array("i", sorted(tables))
+    with open(file, "wb") as f:
+        f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, header_flags(), n, len(goals), map.version()))
+        for goal in goals:
+            f.write(array("d", tables[goal]).tobytes())
+        f.write(goals.tobytes())
+
+# maps a store written by save_store, no table is read until it is asked for
+def load_store(file, capacity=64):
+    reader = SectionReader(file, STORE_HEADER)
+    magic, version, flags, n, k, graph_version = reader.header
+    check_header(file, magic, version, flags, STORE_MAGIC, (STORE_VERSION,))
+    tables = reader.take("d", k*n)
+    goals = reader.take("i", k)
+    return HeuristicStore(tables, goals, n, graph_version, capacity)
+
+# true if the file starts with the heuristic store magic
+def is_store(file):
+    with open(file, "rb") as f:
+        return f.read(len(STORE_MAGIC)) == STORE_MAGIC
+
+# heuristic-build [route file] [output file] [heuristic file or goal=file]...
+# the goal of a plain heuristic file is the city it gives 0
+def heuristic_build_command(argv):
+    from find_route import heuristic_goal, heuristic_table, load_map, read_heuristic
+    if len(argv) < 3:
+        print("Usage: find_route.py heuristic-build [input_file] [output_file] [heuristic_file or goal=heuristic_file]...")
+        sys.exit(2)
+    map, compiled_heuristic = load_map(argv[0])
+    tables = dict()
+    for arg in argv[2:]:
+        goal = None
+        if "=" in arg and not os.path.exists(arg):
+            goal, arg = arg.split("=", 1)
+        heuristic = read_heuristic(os.path.realpath(os.path.abspath(arg)))
+        if goal is None:
+            goal = heuristic_goal(heuristic, map)
+        if goal is None or goal not in map:
+            sys.exit("{0}: no goal on the map, give it as goal={0}".format(arg))
+        tables[map.city_id(goal)] = heuristic_table(heuristic, map)
+    save_store(tables, map, argv[1])
@@ -0,0 +1,72 @@
+import threading
+
+from route_graph import GraphBuilder
+
+# bytes read from a text file at a time
+CHUNK_SIZE = 1 << 20
+
+# yields the stripped, non empty lines of a text file up to END OF INPUT.
+# The file is read in chunk_size pieces and only the lines of the current
+# piece are held, so memory does not grow with the file.
+def read_lines(file, chunk_size=CHUNK_SIZE):
+    with open(file, "rb") as f:
+        rest = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                rest = chunk
+                continue
+            rest = chunk[end+1:]
+            for line in chunk[:end].decode("utf-8").split("\n"):
+                line = line.strip()
+                if line == "END OF INPUT":
+                    return
+                if line:
+                    yield line
+        line = rest.decode("utf-8").strip()
+        if line and line != "END OF INPUT":
+            yield line
+
+# splits a route file line, "city1 city2 km"
+def parse_road(line):
+    line = line.split(" ")
+    return line[0], line[1], float(line[2])
+
+# adds every road of a route file to a GraphBuilder
+def load_roads(file, builder, chunk_size=CHUNK_SIZE):
+    for line in read_lines(file, chunk_size):
+        builder.add_road(*parse_road(line))
+    return builder
+
+# reads a route file on a background thread, so the caller can get on with
+# other work (e.g. reading the heuristic file) meanwhile. The search itself
+# has to wait for graph(): until the last road is in, a road still to come
+# could shorten any route found so far.
+class GraphLoader(threading.Thread):
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        threading.Thread.__init__(self, daemon=True)
+        self.file = file
+        self.chunk_size = chunk_size
+        self.builder = GraphBuilder()
+        self.error = None
+
+    def run(self):
+        try:
+            load_roads(self.file, self.builder, self.chunk_size)
+        except Exception as error:
+            self.error = error
+
+    # roads read so far
+    def progress(self):
+        return len(self.builder.weights)
+
+    # waits for the whole file and packs it into a Graph
+    def graph(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.builder.build()
@@ -0,0 +1,120 @@
+import argparse
+import os
+import struct
+import sys
+
+from find_route import load_map
+from route_graph import NameIndex, NameTable, SectionReader, check_header, encode_names, fork_context, header_flags
+from route_search import shortest_path_tree
+
+# distance matrix file: header, then dist float64[n*n] (row i holds the km
+# from city i to every city, infinity when unreachable), name offsets
+# int64[n+1], sorted ids int32[n], names utf-8. graph version is
+# Graph.version() of the map it came from.
+MATRIX_MAGIC = b"RGDM"
+MATRIX_VERSION = 2
+MATRIX_HEADER = struct.Struct("<4sHHqqq")
+
+INFINITY = float("inf")
+
+# the map shared by the worker processes, loaded in the parent before the
+# pool starts so forked workers inherit it
+_map = None
+
+def _init_worker(route):
+    global _map
+    if _map is None:
+        _map, compiled_heuristic = load_map(route)
+
+# one row of the matrix, the km from a source to every city
+def _row(source):
+    return shortest_path_tree(source, _map).dist.tobytes()
+
+# all pairs distance matrix of a map, mapped from a file written by
+# build_matrix. A lookup is one multiplication and one array read.
+class DistanceMatrix:
+    def __init__(self, names, ids, dist, graph_version):
+        self.names = names
+        self.ids = ids
+        self.dist = dist
+        self.graph_version = graph_version
+
+    def __len__(self):
+        return len(self.names)
+
+    def city_id(self, name):
+        return self.ids.get(name)
+
+    # km between two city ids, infinity when there is no route
+    def distance_between(self, city1, city2):
+        return self.dist[city1*len(self.names) + city2]
+
+    # km between two city names, None when a city is not on the map
+    def distance(self, city1, city2):
+        city1 = self.ids.get(city1)
+        city2 = self.ids.get(city2)
+        if city1 is None or city2 is None:
+            return None
+        return self.distance_between(city1, city2)
+
+    # true if the matrix was computed from this version of the map
+    def matches(self, map):
+        return len(self.names) == len(map) and self.graph_version == map.version()
+
+# runs a shortest path tree from every city, spread over a process pool,
+# and writes the rows to the file in city order as they come back, so only
+# the rows in flight are held in memory
+def build_matrix(route, file, workers=None, chunksize=16):
+    _init_worker(route)
+    map = _map
+    n = len(map)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    name_offsets, order, names = encode_names(map)
+
+    with open(file, "wb") as f:
+        f.write(MATRIX_HEADER.pack(MATRIX_MAGIC, MATRIX_VERSION, header_flags(), n, map.edge_count(), map.version()))
+        if workers <= 1:
+            for source in range(n):
+                f.write(_row(source))
+        else:
+            with fork_context().Pool(workers, _init_worker, (route,)) as pool:
+                for row in pool.imap(_row, range(n), chunksize):
+                    f.write(row)
+        f.write(name_offsets.tobytes())
+        f.write(order.tobytes())
+        f.write(names)
+
+# maps a matrix file written by build_matrix
+def load_matrix(file):
+    reader = SectionReader(file, MATRIX_HEADER)
+    magic, version, flags, n, m, graph_version = reader.header
+    check_header(file, magic, version, flags, MATRIX_MAGIC, (MATRIX_VERSION,))
+    dist = reader.take("d", n*n)
+    name_offsets = reader.take("q", n+1)
+    order = reader.take("i", n)
+    names = NameTable(name_offsets, reader.take_bytes(name_offsets[n]))
+    return DistanceMatrix(names, NameIndex(names, order), dist, graph_version)
+
+# matrix [route file] [output file] [--workers N]
+def matrix_command(argv):
+    parser = argparse.ArgumentParser(prog="find_route.py matrix",
+                                     description="compute the all pairs distance matrix of a map")
+    parser.add_argument("route", help="route file, text or compiled")
+    parser.add_argument("output", help="matrix file to write")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, default one per cpu")
+    args = parser.parse_args(argv)
+    build_matrix(args.route, args.output, args.workers)
+
+# lookup [matrix file] [city1] [city2]
+def lookup_command(argv):
+    if len(argv) < 3:
+        print("Usage: find_route.py lookup [matrix_file] [city1] [city2]")
+        sys.exit(2)
+    matrix = load_matrix(argv[0])
+    distance = matrix.distance(argv[1], argv[2])
+    if distance is None or distance == INFINITY:
+        print("distance: infinity")
+    else:
+        print("distance: {0} km".format(distance))
@@ -0,0 +1,204 @@
+import copy
+import heapq
+import os
+import sys
+
+from find_route import create_chain, create_node, format_result, heuristic_table, load_map, read_heuristic, route_result
+
+INFINITY = float("inf")
+
+# Long lived route planner using Lifelong Planning A* (LPA*). It keeps g (the
+# km found so far) and rhs (the one step lookahead, the best g of a
+# neighbour plus the road) for every city. Only cities where the two
+# disagree are queued, so after a road changes just the cities whose
+# distance it affects get expanded again.
+class RoutePlanner:
+    def __init__(self, map, start, goal, heuristic=None):
+        n = len(map)
+        self.names = [map.city_name(city) for city in range(n)]
+        self.ids = dict((name, city) for city, name in enumerate(self.names))
+        # adjacency that can change, city -> {neighbour: km}, parallel roads
+        # keep the shortest
+        self.roads = [dict() for i in range(n)]
+        for city in range(n):
+            for neighbor, weight in map.neighbors(city):
+                if weight < self.roads[city].get(neighbor, INFINITY):
+                    self.roads[city][neighbor] = weight
+
+        self.start = self.intern(start)
+        self.goal = self.intern(goal)
+        # must stay consistent as roads change, e.g. straight line distances
+        self.heuristic = heuristic_table(heuristic, map, map.city_id(goal))
+        self.reset()
+
+    # forgets all search state, the next plan starts from scratch
+    def reset(self):
+        self.g = [INFINITY] * len(self.names)
+        self.rhs = [INFINITY] * len(self.names)
+        self.queue = list() # heap of (key, city), stale ones are skipped
+        self.queued = dict() # city -> key it is queued with
+        self.nodes_expanded = 0 # by the last plan
+        self.nodes_generated = 0
+        self.rhs[self.start] = 0
+        self.push(self.start)
+
+    # id of a city, adding it when a road to a new city comes in
+    def intern(self, name):
+        city = self.ids.get(name)
+        if city is None:
+            city = len(self.names)
+            self.ids[name] = city
+            self.names.append(name)
+            self.roads.append(dict())
+            # no search state yet while the planner is being set up
+            if hasattr(self, "g"):
+                self.g.append(INFINITY)
+                self.rhs.append(INFINITY)
+        return city
+
+    def h(self, city):
+        if self.heuristic and city < len(self.heuristic):
+            return self.heuristic[city]
+        return 0
+
+    def key(self, city):
+        best = min(self.g[city], self.rhs[city])
+        return (best + self.h(city), best)
+
+    def push(self, city):
+        key = self.key(city)
+        self.queued[city] = key
+        self.nodes_generated += 1
+        heapq.heappush(self.queue, (key, city))
+
+    # smallest live key, skipping stale heap entries
+    def top_key(self):
+        while self.queue:
+            key, city = self.queue[0]
+            if self.queued.get(city) == key:
+                return key
+            heapq.heappop(self.queue)
+        return (INFINITY, INFINITY)
+
+    # recomputes rhs of a city and queues it when g and rhs disagree
+    def update_city(self, city):
+        if city != self.start:
+            best = INFINITY
+            for neighbor, weight in self.roads[city].items():
+                if self.g[neighbor] + weight < best:
+                    best = self.g[neighbor] + weight
+            self.rhs[city] = best
+        self.queued.pop(city, None)
+        if self.g[city] != self.rhs[city]:
+            self.push(city)
+
+    # expands queued cities until the goal's distance is settled. Returns
+    # the cities expanded by this call.
+    def plan(self):
+        self.nodes_expanded = 0
+        self.nodes_generated = 0
+        while self.top_key() < self.key(self.goal) or self.rhs[self.goal] != self.g[self.goal]:
+            key, city = heapq.heappop(self.queue)
+            del self.queued[city]
+            self.nodes_expanded += 1
+            if self.g[city] > self.rhs[city]:
+                self.g[city] = self.rhs[city]
+                for neighbor in self.roads[city]:
+                    self.update_city(neighbor)
+            else:
+                self.g[city] = INFINITY
+                self.update_city(city)
+                for neighbor in self.roads[city]:
+                    self.update_city(neighbor)
+        return self.nodes_expanded
+
+    # sets the km of a road, adding it (and new cities) when missing.
+    # distance None closes the road. Call plan afterwards to repair the route.
+    def update_road(self, city1, city2, distance):
+        a = self.intern(city1)
+        b = self.intern(city2)
+        if distance is None:
+            self.roads[a].pop(b, None)
+            self.roads[b].pop(a, None)
+        else:
+            self.roads[a][b] = distance
+            self.roads[b][a] = distance
+        self.update_city(a)
+        self.update_city(b)
+
+    # node chain of the current route, None when the goal is unreachable
+    def route(self):
+        if self.g[self.goal] == INFINITY:
+            return None
+        if self.goal == self.start:
+            return create_node(city=self.start, distance=0, cost=0)
+        cities = [self.goal]
+        distances = list()
+        city = self.goal
+        while city != self.start:
+            best = None
+            for neighbor, weight in self.roads[city].items():
+                if best is None or self.g[neighbor] + weight < self.g[best[0]] + best[1]:
+                    best = (neighbor, weight)
+            cities.append(best[0])
+            distances.append(best[1])
+            city = best[0]
+        distances.append(0)
+        cities.reverse()
+        distances.reverse()
+        return create_chain(cities, distances)
+
+    # the cities a planner built from scratch on the current roads expands,
+    # what a full restart costs compared to the last plan
+    def restart_expansions(self):
+        fresh = copy.copy(self)
+        fresh.reset()
+        return fresh.plan()
+
+    # city names lookup for route_result
+    def city_name(self, city):
+        return self.names[city]
+
+# reads road updates, one per line: "city1 city2 km" sets (or adds) a road,
+# "city1 city2 -" closes it
+def read_updates(f):
+    for line in f:
+        line = line.strip()
+        if line == "END OF INPUT":
+            break
+        if line:
+            line = line.split(" ")
+            if line[2] == "-":
+                yield line[0], line[1], None
+            else:
+                yield line[0], line[1], float(line[2])
+
+# replan [route file] [start] [goal] [update file or - for stdin] [heuristic file]
+def replan_command(argv):
+    if len(argv) < 4:
+        print("Usage: find_route.py replan [input_file] [start] [goal] [update_file] [heuristic_file]")
+        sys.exit(2)
+    map, compiled_heuristic = load_map(argv[0])
+    heuristic = None
+    if len(argv) > 4:
+        heuristic = read_heuristic(os.path.realpath(os.path.abspath(argv[4])))
+
+    planner = RoutePlanner(map, argv[1], argv[2], heuristic)
+    planner.plan()
+    print(format_result(route_result(planner.route(), planner.nodes_expanded, planner.nodes_generated, planner)))
+
+    if argv[3] == "-":
+        f = sys.stdin
+    else:
+        f = open(argv[3], "r")
+    try:
+        for city1, city2, distance in read_updates(f):
+            planner.update_road(city1, city2, distance)
+            planner.plan()
+            print()
+            print("update: {0} {1} {2}".format(city1, city2, "closed" if distance is None else distance))
+            print(format_result(route_result(planner.route(), planner.nodes_expanded, planner.nodes_generated, planner)))
+            print("full restart expands: ", planner.restart_expansions())
+    finally:
+        if f is not sys.stdin:
+            f.close()
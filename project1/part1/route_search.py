@@ -0,0 +1,406 @@
+import heapq
+from array import array
+
+from find_route import Fringe, add_to_fringe, create_chain, create_node, heuristic_table
+
+INFINITY = float("inf")
+
+# one side of a bidirectional search. The forward side works towards the
+# goal and may use the goal heuristic, the backward side grows from the goal
+# with plain UCS (there is no heuristic towards the start).
+class SearchSide:
+    def __init__(self, city, map, heuristic=None):
+        self.fringe = Fringe()
+        self.closed = bytearray(len(map)) # generated flag per city id
+        self.reached = dict() # city id -> best node found so far
+        self.heuristic = heuristic
+        head = create_node(city=city, distance=0, cost=self.h(city), g=0)
+        self.closed[city] = 1
+        self.reached[city] = head
+        add_to_fringe(head, self.fringe)
+
+    def h(self, city):
+        if self.heuristic:
+            return self.heuristic[city]
+        return 0
+
+    # lowest priority waiting in the fringe
+    def top(self):
+        node = self.fringe.peek()
+        if node is None:
+            return INFINITY
+        return node.cost
+
+    # the km from this side's root to a city, infinity when not reached
+    def g(self, city):
+        node = self.reached.get(city)
+        if node is None:
+            return INFINITY
+        return node.g
+
+# expands one node of a side. Every road that touches a city the other side
+# has reached closes a start-goal path, the cheapest one is kept in best.
+def expand_side(side, other, map, best, nodes_generated):
+    popped = side.fringe.pop()
+    targets = map.targets
+    weights = map.weights
+    for e in range(map.offsets[popped.city], map.offsets[popped.city+1]):
+        city = targets[e]
+        distance = weights[e]
+        g = distance+popped.g
+        cost = g+side.h(city)
+
+        if side.closed[city]:
+            node = side.fringe.get(city)
+            if node is not None and node.cost > cost:
+                node.parent = popped
+                node.distance = distance
+                node.cost = cost
+                node.g = g
+                side.fringe.update(node)
+            else:
+                node = None
+        else:
+            nodes_generated += 1
+            node = create_node(city=city, distance=distance, cost=cost, g=g)
+            node.parent = popped
+            side.closed[city] = 1
+            side.reached[city] = node
+            add_to_fringe(node, side.fringe)
+
+        if node is not None:
+            total = g+other.g(city)
+            if total < best[0]:
+                best[0] = total
+                best[1] = city
+    return nodes_generated
+
+# joins the forward chain ending at the meeting city with the backward chain
+# from the meeting city to the goal into one start -> goal chain of nodes
+def join_chains(forward, backward):
+    tail = forward
+    while backward.parent is not None:
+        node = create_node(city=backward.parent.city, distance=backward.distance,
+                           cost=tail.g+backward.distance, g=tail.g+backward.distance)
+        node.parent = tail
+        tail = node
+        backward = backward.parent
+    return tail
+
+# searches forward from start and backward from goal at the same time,
+# always growing the side with the smaller fringe. Stops once no path
+# through either fringe can beat the best meeting found: without a
+# heuristic when top(forward) + top(backward) >= best, with one when either
+# top alone is >= best (both sides' priorities are lower bounds then).
+# Returns the goal node of the route chain and the node counters like ucs_search.
+def bidirectional_search(start, goal, map, heuristic=None):
+    start = map.city_id(start)
+    goal = map.city_id(goal)
+    if start is None or goal is None:
+        return None, 1, 0
+    if start == goal:
+        return create_node(city=start, distance=0, cost=0), 1, 0
+    if not map.connected(start, goal):
+        return None, 0, 0
+
+    heuristic = heuristic_table(heuristic, map, goal)
+    forward = SearchSide(start, map, heuristic)
+    backward = SearchSide(goal, map)
+    best = [INFINITY, None] # km of the best path found and its meeting city
+    nodes_expanded = 0
+    nodes_generated = 0
+
+    while len(forward.fringe) > 0 and len(backward.fringe) > 0:
+        if heuristic:
+            if forward.top() >= best[0] or backward.top() >= best[0]:
+                break
+        elif forward.top() + backward.top() >= best[0]:
+            break
+
+        nodes_expanded += 1
+        if len(forward.fringe) <= len(backward.fringe):
+            nodes_generated = expand_side(forward, backward, map, best, nodes_generated)
+        else:
+            nodes_generated = expand_side(backward, forward, map, best, nodes_generated)
+
+    if best[1] is None:
+        return None, nodes_expanded, nodes_generated
+    meet = best[1]
+    return join_chains(forward.reached[meet], backward.reached[meet]), nodes_expanded, nodes_generated
+
+# result of a Dijkstra run from one source over the whole map: the km to
+# every city (infinity when unreachable), the parent city (-1 for none) and
+# the road from the parent, plus the node counters of the run.
+class ShortestPathTree:
+    def __init__(self, source, dist, parent, road, nodes_expanded, nodes_generated):
+        self.source = source
+        self.dist = dist
+        self.parent = parent
+        self.road = road
+        self.nodes_expanded = nodes_expanded
+        self.nodes_generated = nodes_generated
+
+    # node chain of the route from the source to goal, None when unreachable
+    def route(self, goal):
+        if self.dist[goal] == INFINITY:
+            return None
+        cities = list()
+        distances = list()
+        city = goal
+        while city != -1:
+            cities.append(city)
+            distances.append(self.road[city])
+            city = self.parent[city]
+        cities.reverse()
+        distances.reverse()
+        return create_chain(cities, distances)
+
+# runs Dijkstra from a source city id until every reachable city is settled
+def shortest_path_tree(source, map):
+    n = len(map)
+    dist = array("d", [INFINITY]) * n
+    parent = array("q", [-1]) * n
+    road = array("d", bytes(8 * n))
+    done = bytearray(n)
+    fringe = Fringe()
+    nodes_expanded = 0
+    nodes_generated = 0
+
+    dist[source] = 0
+    add_to_fringe(create_node(city=source, distance=0, cost=0), fringe)
+    targets = map.targets
+    weights = map.weights
+    while len(fringe) > 0:
+        popped = fringe.pop()
+        nodes_expanded += 1
+        done[popped.city] = 1
+        for e in range(map.offsets[popped.city], map.offsets[popped.city+1]):
+            city = targets[e]
+            g = popped.g + weights[e]
+            if done[city] or g >= dist[city]:
+                continue
+            if dist[city] == INFINITY:
+                nodes_generated += 1
+            dist[city] = g
+            parent[city] = popped.city
+            road[city] = weights[e]
+            node = fringe.get(city)
+            if node is None:
+                add_to_fringe(create_node(city=city, distance=weights[e], cost=g), fringe)
+            else:
+                node.cost = g
+                node.g = g
+                fringe.update(node)
+
+    return ShortestPathTree(source, dist, parent, road, nodes_expanded, nodes_generated)
+
+# cheapest spur path from spur to the goal avoiding the banned cities and the
+# banned roads out of spur. The goal's shortest path tree gives exact
+# distances on the full map, so it is a consistent A* heuristic here, and
+# when the tree's own path avoids everything banned it is the answer as is.
+# Returns the cities, the road km into each and the node counters.
+def spur_search(spur, goal, map, tree, banned_cities, banned_roads):
+    cities = [spur]
+    distances = [0]
+    city = spur
+    while city != goal and city not in banned_cities and (city != spur or tree.parent[city] not in banned_roads):
+        distances.append(tree.road[city])
+        city = tree.parent[city]
+        cities.append(city)
+    if city == goal:
+        return cities, distances, 0, 0
+
+    fringe = Fringe()
+    closed = bytearray(len(map))
+    nodes_expanded = 0
+    nodes_generated = 0
+    closed[spur] = 1
+    add_to_fringe(create_node(city=spur, distance=0, cost=tree.dist[spur], g=0), fringe)
+    targets = map.targets
+    weights = map.weights
+    while len(fringe) > 0:
+        popped = fringe.pop()
+        nodes_expanded += 1
+        if popped.city == goal:
+            cities = list()
+            distances = list()
+            while popped is not None:
+                cities.append(popped.city)
+                distances.append(popped.distance)
+                popped = popped.parent
+            cities.reverse()
+            distances.reverse()
+            return cities, distances, nodes_expanded, nodes_generated
+
+        for e in range(map.offsets[popped.city], map.offsets[popped.city+1]):
+            city = targets[e]
+            if city in banned_cities or (popped.city == spur and city in banned_roads):
+                continue
+            g = popped.g + weights[e]
+            cost = g + tree.dist[city]
+            if closed[city]:
+                node = fringe.get(city)
+                if node is not None and node.cost > cost:
+                    node.parent = popped
+                    node.distance = weights[e]
+                    node.cost = cost
+                    node.g = g
+                    fringe.update(node)
+            else:
+                nodes_generated += 1
+                closed[city] = 1
+                node = create_node(city=city, distance=weights[e], cost=cost, g=g)
+                node.parent = popped
+                add_to_fringe(node, fringe)
+    return None, None, nodes_expanded, nodes_generated
+
+# Yen's k shortest loopless routes. Every spur search shares one shortest
+# path tree grown from the goal (see spur_search). Returns up to k
+# (route chain, nodes expanded, nodes generated) tuples, shortest first, the
+# counters being the work it took to find that route.
+def k_shortest_routes(start, goal, map, k):
+    start = map.city_id(start)
+    goal = map.city_id(goal)
+    if start is None or goal is None or not map.connected(start, goal) or k < 1:
+        return list()
+
+    tree = shortest_path_tree(goal, map)
+    cities, distances, nodes_expanded, nodes_generated = spur_search(start, goal, map, tree, set(), set())
+    found = [(cities, distances)]
+    results = [(create_chain(cities, distances), tree.nodes_expanded, tree.nodes_generated)]
+    candidates = list() # heap of (km, order, cities, distances)
+    seen = set([tuple(cities)])
+    order = 0
+
+    while len(found) < k:
+        nodes_expanded = 0
+        nodes_generated = 0
+        cities, distances = found[-1]
+        root_km = 0
+        for i in range(len(cities) - 1):
+            spur = cities[i]
+            root = cities[:i+1]
+            banned_roads = set()
+            for other, other_distances in found:
+                if other[:i+1] == root:
+                    banned_roads.add(other[i+1])
+            banned_cities = set(root[:-1])
+
+            spur_cities, spur_distances, expanded, generated = spur_search(spur, goal, map, tree, banned_cities, banned_roads)
+            nodes_expanded += expanded
+            nodes_generated += generated
+            if spur_cities is not None:
+                route = root[:-1] + spur_cities
+                if tuple(route) not in seen:
+                    seen.add(tuple(route))
+                    route_distances = distances[:i+1] + spur_distances[1:]
+                    heapq.heappush(candidates, (root_km + sum(spur_distances), order, route, route_distances))
+                    order += 1
+            root_km += distances[i+1]
+
+        if not candidates:
+            break
+        km, o, cities, distances = heapq.heappop(candidates)
+        found.append((cities, distances))
+        results.append((create_chain(cities, distances), nodes_expanded, nodes_generated))
+
+    return results
+
+# IDA*: depth first searches with a growing bound on g + h. Memory is the
+# current path plus a transposition table of the best g reached per city in
+# this pass, capped at budget cities (the city with the largest g makes room
+# for a new one, cheap cities near the start cut off the biggest subtrees),
+# so it trades expanding cities again for a fixed amount of memory; the
+# further the budget is below the cities within the bound, the more work.
+# With km distances almost every route has its own g + h, so the bound grows
+# by at least BOUND_GROWTH per pass instead of one value at a time; a pass
+# that overshoots keeps searching below the best route found so far, so the
+# answer stays optimal when the heuristic never overestimates.
+BOUND_GROWTH = 1.25
+
+def ida_search(start, goal, map, heuristic, budget=65536):
+    start = map.city_id(start)
+    goal = map.city_id(goal)
+    if start is None:
+        return None, 1, 0
+    if goal is None or not map.connected(start, goal):
+        return None, 0, 0
+    if start == goal:
+        return create_node(city=start, distance=0, cost=0), 1, 0
+    heuristic = heuristic_table(heuristic, map, goal)
+    budget = max(budget, 1)
+
+    offsets = map.offsets
+    targets = map.targets
+    weights = map.weights
+    on_path = bytearray(len(map))
+    nodes_expanded = 0
+    nodes_generated = 0
+    bound = heuristic[start] if heuristic else 0
+    while bound < INFINITY:
+        next_bound = INFINITY
+        found = None
+        table = dict() # city -> least g reached in this pass
+        deepest = list() # heap of (-g, city), stale ones are skipped
+        # the current path, with the next road to try out of every city
+        cities = [start]
+        distances = [0]
+        gs = [0]
+        edges = [offsets[start]]
+        on_path[start] = 1
+        nodes_expanded += 1
+        while cities:
+            top = cities[-1]
+            e = edges[-1]
+            if e == offsets[top+1]:
+                on_path[top] = 0
+                cities.pop()
+                distances.pop()
+                gs.pop()
+                edges.pop()
+                continue
+            edges[-1] = e + 1
+
+            city = targets[e]
+            if on_path[city]:
+                continue
+            g = gs[-1] + weights[e]
+            cost = g + heuristic[city] if heuristic else g
+            nodes_generated += 1
+            if cost > bound:
+                if cost < next_bound:
+                    next_bound = cost
+                continue
+            if city == goal:
+                # only routes shorter than this one are searched from now on
+                found = create_chain(cities + [city], distances + [weights[e]])
+                bound = g
+                continue
+            best = table.get(city)
+            if best is not None and g >= best:
+                continue
+            if best is None and len(table) >= budget:
+                # full, forget the city reached with the largest g
+                while True:
+                    far = heapq.heappop(deepest)
+                    if table.get(far[1]) == -far[0]:
+                        break
+                del table[far[1]]
+            table[city] = g
+            heapq.heappush(deepest, (-g, city))
+            if len(deepest) > 2*budget:
+                deepest = [(-known, other) for other, known in table.items()]
+                heapq.heapify(deepest)
+
+            cities.append(city)
+            distances.append(weights[e])
+            gs.append(g)
+            edges.append(offsets[city])
+            on_path[city] = 1
+            nodes_expanded += 1
+        if found is not None:
+            return found, nodes_expanded, nodes_generated
+        if next_bound < INFINITY:
+            next_bound = max(next_bound, bound * BOUND_GROWTH)
+        bound = next_bound
+    return None, nodes_expanded, nodes_generated
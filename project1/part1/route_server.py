@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from route_batch import QueryContext
+
+# Answers route queries from a map loaded once. A request is one JSON
+# object per line, {"start": "Bremen", "goal": "Kassel"} plus an optional
+# "id" that is echoed back. The answer is the route_result dict (nodes
+# expanded, nodes generated, distance, route) with start and goal, or
+# {"error": message}. Requests are answered as they finish, so a client
+# sending several at once should match them up by id.
+
+# answers one request line from a route_batch.QueryContext
+def answer(line, context):
+    request = None
+    try:
+        request = json.loads(line)
+        pair = (request["start"], request["goal"])
+        for city in pair:
+            if not isinstance(city, str):
+                raise TypeError("start and goal must be city names, got {0!r}".format(city))
+    except (ValueError, KeyError, TypeError) as error:
+        result = {"error": "bad request: {0}".format(error)}
+    else:
+        # a failed search still gets an answer, or its client would wait forever
+        try:
+            result = context.query(pair)
+        except Exception as error:
+            result = {"error": "{0}: {1}".format(type(error).__name__, error)}
+    if isinstance(request, dict) and "id" in request:
+        result["id"] = request["id"]
+    return json.dumps(result) + "\n"
+
+# reads request lines from a stream and writes the answers, every request
+# runs on the executor so slow queries do not hold up the others
+async def serve_stream(reader, write, executor, context):
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    async def run(line):
+        write((await loop.run_in_executor(executor, answer, line, context)).encode("utf-8"))
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.decode("utf-8").strip()
+        if not line:
+            continue
+        task = asyncio.ensure_future(run(line))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+
+# serves requests on a Unix socket until interrupted
+async def serve_socket(path, executor, context):
+    async def connection(reader, writer):
+        try:
+            await serve_stream(reader, writer.write, executor, context)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(connection, path)
+    async with server:
+        await server.serve_forever()
+
+# serves requests read from stdin, answers go to stdout
+async def serve_stdio(executor, context):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    def write(data):
+        sys.stdout.write(data.decode("utf-8"))
+        sys.stdout.flush()
+
+    await serve_stream(reader, write, executor, context)
+
+# serve [route file] [--socket PATH] [--heuristic file] [--threads N]
+def serve_command(argv):
+    parser = argparse.ArgumentParser(prog="find_route.py serve",
+                                     description="answer JSON line route queries from one map load")
+    parser.add_argument("route", help="route file, text or compiled")
+    parser.add_argument("--socket", default=None, metavar="PATH",
+                        help="listen on a Unix socket, default is stdin/stdout")
+    parser.add_argument("--heuristic", default=None, help="heuristic file, used for queries to its goal")
+    parser.add_argument("--threads", type=int, default=4, help="queries answered at the same time")
+    parser.add_argument("--tree-cache", type=int, default=0, metavar="N",
+                        help="answer from up to N cached shortest path trees")
+    args = parser.parse_args(argv)
+
+    context = QueryContext(args.route, args.heuristic, args.tree_cache)
+    executor = ThreadPoolExecutor(args.threads)
+    try:
+        if args.socket:
+            asyncio.run(serve_socket(args.socket, executor, context))
+        else:
+            asyncio.run(serve_stdio(executor, context))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown()
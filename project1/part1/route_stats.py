@@ -0,0 +1,129 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from find_route import Fringe
+
+# Hook points of a query. ucs_search only calls into hooks when it is given
+# some, so the default search pays nothing. A profiler subclasses this and
+# overrides what it needs.
+class SearchHooks:
+    def begin_phase(self, name):
+        pass
+
+    def end_phase(self, name):
+        pass
+
+    # the fringe ucs_search uses when the caller passes none
+    def new_fringe(self):
+        return Fringe()
+
+    # wraps the heuristic table of the query, called once per search
+    def watch_heuristic(self, heuristic):
+        return heuristic
+
+    @contextmanager
+    def phase(self, name):
+        self.begin_phase(name)
+        try:
+            yield
+        finally:
+            self.end_phase(name)
+
+# fringe counting decrease-keys, the re-queues expand_node makes when it
+# finds a cheaper path to a city already waiting
+class CountingFringe(Fringe):
+    def __init__(self):
+        Fringe.__init__(self)
+        self.reorders = 0
+
+    def update(self, city_node):
+        self.reorders += 1
+        Fringe.update(self, city_node)
+
+# heuristic table counting its lookups
+class CountingHeuristic:
+    def __init__(self, table):
+        self.table = table
+        self.lookups = 0
+
+    def __bool__(self):
+        return True
+
+    def __getitem__(self, city):
+        self.lookups += 1
+        return self.table[city]
+
+# collects the timings and counters --stats prints: seconds per phase,
+# peak fringe, reorders, heuristic lookups and the tracemalloc peak. Tracing
+# slows every allocation down, so the phases run untraced and the memory
+# peak comes from a separate run of the search (see trace_memory). Searches
+# that take no hooks leave the fringe and heuristic counters as None, not
+# measured, rather than 0.
+class SearchStats(SearchHooks):
+    def __init__(self):
+        self.phases = dict() # name -> seconds
+        self.started = dict()
+        self.fringe = None
+        self.heuristic = None
+        self.watched = False # the search handed its heuristic to watch_heuristic
+        self.peak_memory = None
+
+    def begin_phase(self, name):
+        # phases are listed in the order they begin, overlapping ones included
+        self.phases.setdefault(name, 0)
+        self.started[name] = time.perf_counter()
+
+    def end_phase(self, name):
+        seconds = time.perf_counter() - self.started.pop(name)
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def new_fringe(self):
+        self.fringe = CountingFringe()
+        return self.fringe
+
+    def watch_heuristic(self, heuristic):
+        self.watched = True
+        if not heuristic:
+            return heuristic
+        self.heuristic = CountingHeuristic(heuristic)
+        return self.heuristic
+
+    # calls search again under tracemalloc and keeps its memory peak
+    def trace_memory(self, search):
+        tracemalloc.start()
+        try:
+            search()
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def as_dict(self):
+        # a fringe with nothing left in it is falsy, so check for None
+        fringe = self.fringe is not None
+        lookups = None
+        if self.heuristic is not None:
+            lookups = self.heuristic.lookups
+        elif self.watched:
+            lookups = 0
+        return {"phases": self.phases,
+                "peak_fringe": self.fringe.peak if fringe else None,
+                "reorders": self.fringe.reorders if fringe else None,
+                "heuristic_lookups": lookups,
+                "peak_memory": self.peak_memory}
+
+# writes the stats to stderr so the route output stays as it is
+def print_stats(stats, form="text"):
+    values = stats.as_dict()
+    if form == "json":
+        sys.stderr.write(json.dumps(values) + "\n")
+        return
+    for name, seconds in values["phases"].items():
+        sys.stderr.write("{0} seconds: {1:.6f}\n".format(name, seconds))
+    for name in ("peak_fringe", "reorders", "heuristic_lookups", "peak_memory"):
+        value = values[name]
+        if value is None:
+            value = "not measured"
+        sys.stderr.write("{0}: {1}\n".format(name.replace("_", " "), value))
@@ -4,12 +4,18 @@
 # code provided by Vassilis Athitsos
 # Written to be Python 2.4 compatible for omega
 
-from copy import copy, deepcopy
 from errno import ESTALE
 import random
 import sys
+import time
 from enum import Enum
 
+# numpy is optional, only the batch leaf evaluation uses it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Direction(Enum):
     UP_LEFT = 1
     UP = 2
@@ -20,20 +26,305 @@ class Direction(Enum):
     DOWN = 7
     DOWN_RIGHT = 8
 
-class maxConnect4Game:
+
+# Bitboard layout: every column takes 7 bits, bit 0 of a column is its
+# bottom row and the 7th bit is an always empty sentinel, so a shift never
+# carries a line of pieces over into the next column. gameBoard and the game
+# files count rows from the top, row r is height 5 - r.
+ROWS = 6
+COLUMNS = 7
+COLUMN_BITS = ROWS + 1
+TOP_BITS = [1 << (column*COLUMN_BITS + ROWS - 1) for column in range(COLUMNS)]
+# shifts between neighbouring cells: vertical, horizontal and both diagonals
+LINE_SHIFTS = (1, COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1)
+INFINITY = float("inf")
+
+# Zobrist keys: a random 64 bit number per player and cell bit, a position's
+# hash is the xor of the keys of its pieces. Seeded so hashes are the same
+# on every run.
+_zobrist = random.Random(20220308)
+ZOBRIST = [[0]*(COLUMNS*COLUMN_BITS)] + [[_zobrist.getrandbits(64) for bit in range(COLUMNS*COLUMN_BITS)] for player in (1, 2)]
+# mixed into the key of a search node: the AI player the values are scored
+# for and the player to move, TURN_KEYS[ai][mover]
+TURN_KEYS = [None] + [[0] + [_zobrist.getrandbits(64) for mover in (1, 2)] for ai in (1, 2)]
+# transposition table entries (power of two) and bound types of a stored value
+TABLE_SIZE = 1 << 18
+EXACT = 0
+LOWER = 1
+UPPER = 2
+# nodes searched between looks at the clock in a timed search
+CLOCK_CHECK = 1024
+# columns in the order they are tried when nothing better is known, center
+# first as more fours pass through the middle
+CENTER_ORDER = (3, 2, 4, 1, 5, 0, 6)
+# moves that caused a cutoff kept per ply
+KILLERS = 2
+
+# leaf evaluators for --batch-eval
+BATCH_EVALUATORS = ("python", "numpy")
+
+# raised inside a timed search when its time is up
+class SearchTimeout(Exception):
+    pass
+
+def cellBit(row, column):
+    return 1 << (column*COLUMN_BITS + ROWS - 1 - row)
+
+def popCount(mask):
+    return bin(mask).count("1")
+
+# every line of four cells a four could be made on (69 of them), as the
+# bit indices of its cells, and the windows each bit index is part of
+def _windows():
+    windows = []
+    for column in range(COLUMNS):
+        for height in range(ROWS):
+            for dc, dh in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                if 0 <= column + 3*dc < COLUMNS and 0 <= height + 3*dh < ROWS:
+                    windows.append(tuple((column + i*dc)*COLUMN_BITS + height + i*dh for i in range(4)))
+    return windows
+
+WINDOWS = _windows()
+CELL_WINDOWS = [tuple(w for w, window in enumerate(WINDOWS) if bit in window) for bit in range(COLUMNS*COLUMN_BITS)]
+# score of a run of 0-4 of the player's pieces
+RUN_SCORES = (0, 1, 25, 50, 100)
+# a window's pieces are kept as one code, 5 * player 1's + player 2's. Its
+# value for player 1 is the score of player 1's pieces if player 2 has none
+# in it, minus the score of player 2's if player 1 has none, else 0.
+CODE_STEPS = (0, 5, 1)
+WINDOW_VALUES = [RUN_SCORES[code // 5] if code % 5 == 0 else -RUN_SCORES[code % 5] if code < 5 else 0 for code in range(25)]
+# change of the value when a player adds a piece to a window with that code
+# (0 for full windows, nothing is added to them)
+WINDOW_DELTAS = [None] + [[WINDOW_VALUES[code + CODE_STEPS[player]] - WINDOW_VALUES[code] if code // 5 + code % 5 < 4 else 0
+                           for code in range(25)] for player in (1, 2)]
+
+# one integer mask of pieces per player plus the next free bit of every
+# column, so a move is made or taken back with one or and one add. The
+# evaluation is kept up to date as well: the code of every window and the
+# sum of their values, so a leaf is scored without looking at the board.
+class Position:
+    __slots__ = ("masks", "heights", "pieceCount", "hash", "codes", "score")
+
     def __init__(self):
-        self.gameBoard = [[0 for i in range(7)] for j in range(6)]
+        self.masks = [0, 0, 0] # pieces of player 1 and player 2, index 0 unused
+        self.heights = [column*COLUMN_BITS for column in range(COLUMNS)]
+        self.pieceCount = 0
+        self.hash = 0 # Zobrist hash of the pieces
+        self.codes = [0] * len(WINDOWS) # pieces in every window, see CODE_STEPS
+        self.score = 0 # sum of the window values, for player 1
+
+    # everything needed to put the position back with restore
+    def save(self):
+        return (list(self.masks), list(self.heights), self.pieceCount, self.hash, list(self.codes), self.score)
+
+    def restore(self, saved):
+        masks, heights, self.pieceCount, self.hash, codes, self.score = saved
+        self.masks = list(masks)
+        self.heights = list(heights)
+        self.codes = list(codes)
+
+    # builds a position from 6 rows of 7 ints, top row first, 0 for empty
+    @classmethod
+    def fromRows(cls, rows):
+        position = cls()
+        for column in range(COLUMNS):
+            for row in range(ROWS-1, -1, -1):
+                if rows[row][column]:
+                    position.play(column, rows[row][column])
+        return position
+
+    # the board as 6 rows of 7 ints, top row first
+    def rows(self):
+        return [[self.cell(row, column) for column in range(COLUMNS)] for row in range(ROWS)]
+
+    # player at a cell, 0 if empty
+    def cell(self, row, column):
+        bit = cellBit(row, column)
+        if self.masks[1] & bit:
+            return 1
+        if self.masks[2] & bit:
+            return 2
+        return 0
+
+    def canPlay(self, column):
+        return not (self.masks[1] | self.masks[2]) & TOP_BITS[column]
+
+    # columns that are not full yet, left to right
+    def validColumns(self):
+        occupied = self.masks[1] | self.masks[2]
+        return [column for column in range(COLUMNS) if not occupied & TOP_BITS[column]]
+
+    def play(self, column, player):
+        bit = self.heights[column]
+        self.masks[player] |= 1 << bit
+        self.hash ^= ZOBRIST[player][bit]
+        self.heights[column] += 1
+        self.pieceCount += 1
+        codes = self.codes
+        deltas = WINDOW_DELTAS[player]
+        step = CODE_STEPS[player]
+        score = self.score
+        for window in CELL_WINDOWS[bit]:
+            code = codes[window]
+            score += deltas[code]
+            codes[window] = code + step
+        self.score = score
+
+    # takes back the last piece played in a column
+    def undo(self, column):
+        self.heights[column] -= 1
+        bit = self.heights[column]
+        player = 1 if self.masks[1] >> bit & 1 else 2
+        self.masks[player] &= ~(1 << bit)
+        self.hash ^= ZOBRIST[player][bit]
+        self.pieceCount -= 1
+        codes = self.codes
+        deltas = WINDOW_DELTAS[player]
+        step = CODE_STEPS[player]
+        score = self.score
+        for window in CELL_WINDOWS[bit]:
+            code = codes[window] - step
+            score -= deltas[code]
+            codes[window] = code
+        self.score = score
+
+    # number of 4-in-a-rows of a player. Anding the mask with itself shifted
+    # by one cell leaves the starts of pairs, doing it again with the pairs
+    # shifted by two cells leaves the starts of fours, one bit per four.
+    def countFours(self, player):
+        mask = self.masks[player]
+        count = 0
+        for shift in LINE_SHIFTS:
+            pairs = mask & (mask >> shift)
+            count += popCount(pairs & (pairs >> 2*shift))
+        return count
+
+# Batch leaf evaluation. A node one move above the horizon asks for the
+# scores of all its children at once (for player 1) instead of playing each
+# move and reading the position's score.
+
+# the score after each of player's moves in columns, from the window codes
+# the position keeps: the moved cell's windows change by their deltas
+def childScores(position, player, columns):
+    codes = position.codes
+    deltas = WINDOW_DELTAS[player]
+    heights = position.heights
+    scores = []
+    for column in columns:
+        score = position.score
+        for window in CELL_WINDOWS[heights[column]]:
+            score += deltas[codes[window]]
+        scores.append(score)
+    return scores
+
+# scores stacked child positions with numpy: the masks of all children are
+# unpacked into one (children, player, cell) array, the pieces of every
+# window are summed through the window index table and the window values
+# looked up and summed per child
+class NumpyEvaluator:
+    def __init__(self):
+        self.shifts = numpy.arange(COLUMNS*COLUMN_BITS, dtype=numpy.uint64)
+        self.windows = numpy.array(WINDOWS)
+        self.values = numpy.array(WINDOW_VALUES)
+
+    def __call__(self, position, player, columns):
+        masks = []
+        for column in columns:
+            bit = 1 << position.heights[column]
+            if player == 1:
+                masks.append((position.masks[1] | bit, position.masks[2]))
+            else:
+                masks.append((position.masks[1], position.masks[2] | bit))
+        cells = (numpy.array(masks, dtype=numpy.uint64)[:, :, None] >> self.shifts) & numpy.uint64(1)
+        counts = cells[:, :, self.windows].sum(axis=3)
+        return self.values[5*counts[:, 0] + counts[:, 1]].sum(axis=1).tolist()
+
+# the evaluator for a --batch-eval choice, numpy falls back to the python
+# one when numpy is not installed
+def batchEvaluator(kind="python"):
+    if kind not in BATCH_EVALUATORS:
+        raise ValueError("unknown batch evaluator %s" % kind)
+    if kind == "python" or numpy is None:
+        return childScores
+    return NumpyEvaluator()
+
+# fixed size table of searched positions: key, depth searched, value, bound
+# type, best move and the search (generation) that stored it. A slot keeps
+# the deeper of two entries, unless its entry is from an older search.
+class TranspositionTable:
+    def __init__(self, size=TABLE_SIZE):
+        self.size = 1
+        while self.size < size:
+            self.size *= 2
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+        self.generation = 0
+
+    # called before every search, entries of earlier ones become replaceable
+    def newSearch(self):
+        self.generation += 1
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, value, flag, move):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.entries[index] = (key, depth, value, flag, move, self.generation)
+
+class maxConnect4Game:
+    def __init__(self, tableSize=TABLE_SIZE, ordering=True, batchEval=None):
+        self.position = Position()
+        # scores the children of nodes above the horizon in one call, None
+        # plays and scores them one at a time
+        self.batchEval = batchEval
+        # a maxconnect4_parallel.ParallelSearch splitting the root moves over
+        # worker processes, None searches in this process
+        self.parallel = None
+        # kept for the whole game, so later moves reuse earlier searches
+        self.table = TranspositionTable(tableSize)
+        # move ordering: with ordering off columns go left to right after the
+        # table move, as they did before (the benchmark compares the two)
+        self.ordering = ordering
+        self.killers = [[None]*KILLERS for ply in range(ROWS*COLUMNS + 1)] # by piece count
+        self.history = [[0]*(COLUMNS*COLUMN_BITS) for player in range(3)] # by player and cell bit
+        self.nodes = 0 # positions searched by the last aiPlay
+        self.deadline = None # perf_counter time a timed search has to stop
+        self.searchedDepth = 0 # depth the last aiPlay move comes from
         self.currentTurn = 1
         self.player1Score = 0
         self.player2Score = 0
-        self.pieceCount = 0
         self.gameFile = None
         self.counter = 0
         random.seed()
 
+    # the board as a 6x7 list of lists, top row first. Built from the
+    # bitboard on every access, assigning one replaces the position.
+    @property
+    def gameBoard(self):
+        return self.position.rows()
+
+    @gameBoard.setter
+    def gameBoard(self, rows):
+        self.position = Position.fromRows(rows)
+
+    @property
+    def pieceCount(self):
+        return self.position.pieceCount
+
     # Count the number of pieces already played
     def checkPieceCount(self):
-        self.pieceCount = sum(1 for row in self.gameBoard for piece in row if piece)
+        self.position.pieceCount = popCount(self.position.masks[1] | self.position.masks[2])
+
+    # Read the game state from a game file: 6 rows of 7 digits, then the turn
+    def readGameFile(self, gameFile):
+        file_lines = gameFile.readlines()
+        self.gameBoard = [[int(char) for char in line[0:7]] for line in file_lines[0:-1]]
+        self.currentTurn = int(file_lines[-1][0])
 
     # Output current game status to console
     def printGameBoard(self):
@@ -50,221 +341,30 @@ class maxConnect4Game:
 
     # Place the current player's piece in the requested column
     def playPiece(self, column):
-        if not self.gameBoard[0][column]:
-            for i in range(5, -1, -1):
-                if not self.gameBoard[i][column]:
-                    self.gameBoard[i][column] = self.currentTurn
-                    self.pieceCount += 1
-                    return 1
-    
+        if column is not None and 0 <= column < COLUMNS and self.position.canPlay(column):
+            self.position.play(column, self.currentTurn)
+            return 1
+
     # test what columns are valid for minimax to work on 
     def valid_columns(self):
-        valid_columns = list()
-
-        for column in range(7):
-            if not self.gameBoard[0][column]:
-                for i in range(5, -1, -1):
-                    if not self.gameBoard[i][column]:
-                        valid_columns.append(column)
-                        break
-        
-        return valid_columns
+        return self.position.validColumns()
 
     def score_heuristic(self, score):
-        if score == 4:
-            return 100
-        elif score == 3:
-            return 50
-        elif score == 2:
-            return 25
-        elif score == 1:
-            return 1
-        else:
-            return 0
-
-    def count_pieces(self, board_state, position, agent):
-        score = 0
-        count = 0
-        row = position[0] # row
-        col = position[1] # col
-        # test horizontal
-        for i in range(col):
-            if i != 0:
-                if board_state[row][col-i] == 0 or board_state[row][col-i] != agent:
-                    break
-                elif board_state[row][col-i] == agent:
-                    count += 1
-
-                if count == 4:
-                    break
-        
-        score += self.score_heuristic(count)
-        count = 0
-
-
-        for i in range(7-col):
-            if i != 0:
-                if board_state[row][col+i] == 0 or board_state[row][col+i] != agent:
-                    break
-                elif board_state[row][col+i] == agent:
-                    count += 1
-
-                if count == 4:
-                    break
-
-        score += self.score_heuristic(count)
-        count = 0
-
-        # test vertical
-        for i in range(row):
-            if i != 0:
-                if board_state[row-i][col] == 0 or board_state[row-i][col] != agent:
-                    break
-                elif board_state[row-i][col] == agent:
-                    count += 1
-
-                if count == 4:
-                    break
-
-        score += self.score_heuristic(count)
-        count = 0
-
-        for i in range(6-row):
-            if i != 0:
-                if board_state[row+i][col] == 0 or board_state[row+i][col] != agent:
-                    break
-                elif board_state[row+i][col] == agent:
-                    count += 1
-
-                if count == 4:
-                    break
-
-        score += self.score_heuristic(count)
-        count = 0
-
-        tmp_row = row
-        tmp_col = col
-        # test diagonal left
-        for i in range(row+col):
-            if i != 0:
-                if tmp_col > 0 and tmp_col < 7 and tmp_row > 0 and tmp_row < 6:
-                    if board_state[tmp_row][tmp_col] == 0 or board_state[tmp_row][tmp_col] != agent:
-                        break
-                    elif board_state[tmp_row][tmp_col] == agent:
-                        count += 1
-
-                    if count == 4:
-                        break
-                else:
-                    break
-                tmp_col -= 1
-                tmp_row += 1
-
-        score += self.score_heuristic(count)
-        count = 0
-
-        tmp_row = row
-        tmp_col = col
-        for i in range(row+col):
-            if i != 0:
-                if tmp_col > 0 and tmp_col < 7 and tmp_row > 0 and tmp_row < 6:
-                    if board_state[tmp_row][tmp_col] == 0 or board_state[tmp_row][tmp_col] != agent:
-                        break
-                    elif board_state[tmp_row][tmp_col] == agent:
-                        count += 1
-
-                    if count == 4:
-                        break
-                else:
-                    break
-                tmp_col -= 1
-                tmp_row += 1
-
-        score += self.score_heuristic(count)
-        count = 0
-
-        # test diagonal right
-        tmp_row = row
-        tmp_col = col
-
-        for i in range(row+col):
-            if i != 0:
-                if tmp_col > 0 and tmp_col < 7 and tmp_row > 0 and tmp_row < 6:
-                    if board_state[tmp_row][tmp_col] == 0 or board_state[tmp_row][tmp_col] != agent:
-                        break
-                    elif board_state[tmp_row][tmp_col] == agent:
-                        count += 1
-
-                    if count == 4:
-                        break
-                else:
-                    break
-                tmp_col += 1
-                tmp_row += 1
-
-        score += self.score_heuristic(count)
-        count = 0
-
-        tmp_row = row
-        tmp_col = col
-        for i in range(row+col):
-            if i != 0:
-                if tmp_col > 0 and tmp_col < 7 and tmp_row > 0 and tmp_row < 6:
-                    if board_state[tmp_row][tmp_col] == 0 or board_state[tmp_row][tmp_col] != agent:
-                        break
-                    elif board_state[tmp_row][tmp_col] == agent:
-                        count += 1
-
-                    if count == 4:
-                        break
-                else:
-                    break
-                tmp_col -= 1
-                tmp_row -= 1
-
-        score += self.score_heuristic(count)
-        count = 0
-
-        return score
-
-    # heuristic to determine score of current board
-    def heuristic(self, board_state):
-        score = 0
-        opponent = 0
-        if self.currentTurn == 1:
-            opponent = 2
-        else:
-            opponent = 1
-
-        storeScore1 = self.player1Score
-        storeScore2 = self.player2Score
-
-        tmpBoard = deepcopy(board_state)
-        self.gameBoard = tmpBoard
-
-        self.countScore()
-
-        if self.currentTurn == 1 and self.player1Score > 0:
-            score += 100*self.player1Score
-            self.player1Score = storeScore1
-            self.player2Score = storeScore2
-            self.gameBoard = board_state
-        elif self.currentTurn == 2 and self.player2Score > 0:
-            score += 100*self.player2Score
-            self.player1Score = storeScore1
-            self.player2Score = storeScore2
-            self.gameBoard = board_state
-
-        # evaluate 4 in a rows
-        for x in range(6):
-            for y in range(7):
-                if(board_state[x][y] == 0):
-                    score += self.count_pieces(board_state, (x,y), self.currentTurn)
-                    score -= self.count_pieces(board_state, (x,y), opponent)
-
-        self.gameBoard = board_state
-
-        return score
+        if 0 <= score <= 4:
+            return RUN_SCORES[score]
+        return 0
+
+    # heuristic to determine score of current board for a player (the one
+    # to move by default): over all windows of four cells, the score of the
+    # player's pieces in windows the opponent has none in, minus the score of
+    # the opponent's in windows the player has none in. A four counts 100.
+    # Kept up to date by the position as moves are made and taken back.
+    def heuristic(self, player=None):
+        if player is None:
+            player = self.currentTurn
+        if player == 1:
+            return self.position.score
+        return -self.position.score
 
     def flipTurn(self):
         if self.currentTurn == 1:
@@ -272,33 +372,137 @@ class maxConnect4Game:
         else:
             self.currentTurn = 1
 
-    # minimax algorithm
-    def minimax(self, board_state, depth):
-        val, col = self.maxPlayer(deepcopy(board_state), -9999, 9999, depth-1)
+    # minimax algorithm with alpha-beta pruning for the player to move,
+    # searching depth moves ahead (at least one). Moves are made on the
+    # position and taken back, nothing is copied. Searched positions go to
+    # the transposition table, keyed by the position hash, the AI player and
+    # the player to move. With a parallel search the root moves are searched
+    # by its worker processes instead.
+    def minimax(self, depth):
+        if self.parallel is not None:
+            return self.parallel.minimax(self, depth)
+        val, col = self.rootPlayer(depth)
         return col
 
-    def minPlayer(self, state, alpha, beta, depth):
-        storeBoard = deepcopy(state)
-        self.gameBoard = storeBoard
-
-        val = 9999
-        minCol = 9999
-
-        columns = self.valid_columns()
-
+    # counts a node and, in a timed search, looks at the clock now and then
+    def countNode(self):
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % CLOCK_CHECK == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    # the valid columns in the order to search them for player: the best move
+    # stored for this position (the best line of the previous iteration),
+    # then the killer moves of this ply, then the rest by history score, ties
+    # center first
+    def orderColumns(self, entry, player):
+        position = self.position
+        if not self.ordering:
+            columns = position.validColumns()
+            first = []
+        else:
+            occupied = position.masks[1] | position.masks[2]
+            columns = [column for column in CENTER_ORDER if not occupied & TOP_BITS[column]]
+            history = self.history[player]
+            heights = position.heights
+            columns.sort(key=lambda column: -history[heights[column]])
+            first = list(self.killers[position.pieceCount])
+        if entry is not None:
+            first.append(entry[4])
+        for column in reversed(first):
+            if column in columns:
+                columns.remove(column)
+                columns.insert(0, column)
+        return columns
+
+    # a move of player caused a cutoff depth moves above the horizon: it
+    # becomes the first killer of its ply and its cell gains history, more
+    # the deeper the cutoff. Called with the move taken back.
+    def recordCutoff(self, column, player, depth):
+        if not self.ordering:
+            return
+        position = self.position
+        killers = self.killers[position.pieceCount]
+        if killers[0] != column:
+            killers[1] = killers[0]
+            killers[0] = column
+        self.history[player][position.heights[column]] += (depth+1)*(depth+1)
+
+    # the heuristic values of all children of a node above the horizon
+    # (depth 0) when batch evaluation is on, else None. Every child counts as
+    # a node, a cutoff no longer saves evaluating the later ones.
+    def leafValues(self, columns, player, depth):
+        if self.batchEval is None or depth > 0:
+            return None
         for column in columns:
-            if depth > 0:
-                self.flipTurn()
-                storeBoard = deepcopy(state)
-                self.gameBoard = storeBoard
-                self.playPiece(column)
+            self.countNode()
+        scores = self.batchEval(self.position, player, columns)
+        if self.currentTurn == 1:
+            return scores
+        return [-score for score in scores]
+
+    # the first move. It is always searched, and among moves of equal value
+    # the leftmost is played whatever order they are tried in: columns left of
+    # the best so far are searched with alpha one below its value (values are
+    # whole numbers), so a tie comes back exact instead of cut off.
+    def rootPlayer(self, depth):
+        position = self.position
+        key = position.hash ^ TURN_KEYS[self.currentTurn][self.currentTurn]
+        self.countNode()
+        columns = self.orderColumns(self.table.probe(key), self.currentTurn)
+        if not columns:
+            return self.heuristic(), None
+
+        val = -INFINITY
+        maxCol = None
+        for column in columns:
+            alpha = val
+            if maxCol is not None and column < maxCol:
+                alpha = val - 1
+            position.play(column, self.currentTurn)
+            if depth > 1:
+                tstVal, minCol = self.minPlayer(alpha, INFINITY, depth-2)
+            else:
+                self.countNode()
+                tstVal = self.heuristic()
+            position.undo(column)
 
-                self.flipTurn()
+            if tstVal > val or (tstVal == val and column < maxCol):
+                val = tstVal
+                maxCol = column
 
-                tstVal, maxCol = self.maxPlayer(self.gameBoard, alpha, beta, depth-1)
+        self.table.store(key, depth-1, val, EXACT, maxCol)
+        return val, maxCol
 
+    def minPlayer(self, alpha, beta, depth):
+        position = self.position
+        opponent = 3 - self.currentTurn
+        key = position.hash ^ TURN_KEYS[self.currentTurn][opponent]
+        self.countNode()
+        entry = self.table.probe(key)
+        if entry is not None and entry[1] >= depth:
+            if entry[3] == EXACT or (entry[3] == LOWER and entry[2] >= beta) or (entry[3] == UPPER and entry[2] <= alpha):
+                return entry[2], entry[4]
+
+        columns = self.orderColumns(entry, opponent)
+        # full board, the game is over
+        if not columns:
+            return self.heuristic(), None
+
+        startBeta = beta
+        val = INFINITY
+        minCol = None
+        leafValues = self.leafValues(columns, opponent, depth)
+        for i, column in enumerate(columns):
+            if leafValues is not None:
+                tstVal = leafValues[i]
             else:
-                tstVal = self.heuristic(storeBoard)
+                position.play(column, opponent)
+                if depth > 0:
+                    tstVal, maxCol = self.maxPlayer(alpha, beta, depth-1)
+                else:
+                    self.countNode()
+                    tstVal = self.heuristic()
+                position.undo(column)
 
             if tstVal < val:
                 val = tstVal
@@ -306,34 +510,48 @@ class maxConnect4Game:
 
             if tstVal < beta:
                 beta = tstVal
-                    
-            if tstVal <= beta:
-                break
 
-        storeBoard = deepcopy(state)
-        self.gameBoard = storeBoard
+            if tstVal <= alpha:
+                self.recordCutoff(column, opponent, depth)
+                break
 
+        if val <= alpha:
+            flag = UPPER
+        elif val >= startBeta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(key, depth, val, flag, minCol)
         return val, minCol
 
-    def maxPlayer(self, state, alpha, beta, depth):
-        # row, col
-        storeBoard = deepcopy(state)
-        self.gameBoard = storeBoard
-
-        columns = self.valid_columns()
-        val = -9999
-        maxCol = -9999
-
-        for column in columns:
-            if depth > 0:
-                storeBoard = deepcopy(state)
-                self.gameBoard = storeBoard
-                self.playPiece(column)
-
-                tstVal, minCol = self.minPlayer(self.gameBoard, alpha, beta, depth-1)
-
+    def maxPlayer(self, alpha, beta, depth):
+        position = self.position
+        key = position.hash ^ TURN_KEYS[self.currentTurn][self.currentTurn]
+        self.countNode()
+        entry = self.table.probe(key)
+        if entry is not None and entry[1] >= depth:
+            if entry[3] == EXACT or (entry[3] == LOWER and entry[2] >= beta) or (entry[3] == UPPER and entry[2] <= alpha):
+                return entry[2], entry[4]
+
+        columns = self.orderColumns(entry, self.currentTurn)
+        if not columns:
+            return self.heuristic(), None
+
+        startAlpha = alpha
+        val = -INFINITY
+        maxCol = None
+        leafValues = self.leafValues(columns, self.currentTurn, depth)
+        for i, column in enumerate(columns):
+            if leafValues is not None:
+                tstVal = leafValues[i]
             else:
-                tstVal = self.heuristic(storeBoard)
+                position.play(column, self.currentTurn)
+                if depth > 0:
+                    tstVal, minCol = self.minPlayer(alpha, beta, depth-1)
+                else:
+                    self.countNode()
+                    tstVal = self.heuristic()
+                position.undo(column)
 
             if tstVal > val:
                 val = tstVal
@@ -341,234 +559,65 @@ class maxConnect4Game:
 
             if tstVal > alpha:
                 alpha = tstVal
-                    
+
             if tstVal >= beta:
+                self.recordCutoff(column, self.currentTurn, depth)
                 break
- 
-        storeBoard = deepcopy(state)
-        self.gameBoard = storeBoard
-        
+
+        if val <= startAlpha:
+            flag = UPPER
+        elif val >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(key, depth, val, flag, maxCol)
         return val, maxCol
-       
-
-    # The AI section. Currently plays randomly.
-    def aiPlay(self, depth):
-        storeBoard = deepcopy(self.gameBoard)
-        pieceCount = deepcopy(self.pieceCount)
-        player1score = deepcopy(self.player1Score)
-        player2score = deepcopy(self.player2Score)
-        column = self.minimax(self.gameBoard, depth)
-
-        # reset the board back to original
-        self.gameBoard = storeBoard
-        self.player1Score = player1score
-        self.player2Score = player2score
-        self.pieceCount = pieceCount
 
+    # iterative deepening: searches depth 1, 2, ... up to maxDepth until
+    # timeMs milliseconds are up, each depth trying the best line of the one
+    # before first. Returns the move of the deepest search that finished
+    # (depth 1 always finishes) and that depth.
+    def timedMinimax(self, timeMs, maxDepth):
+        maxDepth = max(1, min(maxDepth, ROWS*COLUMNS - self.position.pieceCount))
+        deadline = time.perf_counter() + timeMs / 1000.0
+        saved = self.position.save()
+        column = self.minimax(1)
+        depth = 1
+        try:
+            self.deadline = deadline
+            while depth < maxDepth:
+                column = self.minimax(depth+1)
+                depth += 1
+        except SearchTimeout:
+            # the search stopped with moves still made, put the board back
+            self.position.restore(saved)
+        finally:
+            self.deadline = None
+        return column, depth
+
+    # killers are forgotten between moves, history counts are halved so the
+    # last search counts most
+    def newOrdering(self):
+        for killers in self.killers:
+            killers[:] = [None]*KILLERS
+        for history in self.history:
+            for bit in range(len(history)):
+                history[bit] >>= 1
+
+    # The AI section, plays the minimax move for the player to move. With
+    # timeMs it deepens until the time is up, depth is then the deepest it goes.
+    def aiPlay(self, depth, timeMs=None):
+        self.table.newSearch()
+        self.newOrdering()
+        self.nodes = 0
+        if timeMs is None:
+            column = self.minimax(depth)
+            self.searchedDepth = depth
+        else:
+            column, self.searchedDepth = self.timedMinimax(timeMs, depth)
         self.playPiece(column)
 
-
     # Calculate the number of 4-in-a-row each player has
     def countScore(self):
-        self.player1Score = 0
-        self.player2Score = 0
-
-        #self.printGameBoard()
-
-        # Check horizontally
-        for row in self.gameBoard:
-            #print(row)
-            # Check player 1
-            if row[0:4] == [1]*4:
-                self.player1Score += 1
-            if row[1:5] == [1]*4:
-                self.player1Score += 1
-            if row[2:6] == [1]*4:
-                self.player1Score += 1
-            if row[3:7] == [1]*4:
-                self.player1Score += 1
-            # Check player 2
-            if row[0:4] == [2]*4:
-                self.player2Score += 1
-            if row[1:5] == [2]*4:
-                self.player2Score += 1
-            if row[2:6] == [2]*4:
-                self.player2Score += 1
-            if row[3:7] == [2]*4:
-                self.player2Score += 1
-
-        # Check vertically
-        for j in range(7):
-            # Check player 1
-            if (self.gameBoard[0][j] == 1 and self.gameBoard[1][j] == 1 and
-                   self.gameBoard[2][j] == 1 and self.gameBoard[3][j] == 1):
-                self.player1Score += 1
-            if (self.gameBoard[1][j] == 1 and self.gameBoard[2][j] == 1 and
-                   self.gameBoard[3][j] == 1 and self.gameBoard[4][j] == 1):
-                self.player1Score += 1
-            if (self.gameBoard[2][j] == 1 and self.gameBoard[3][j] == 1 and
-                   self.gameBoard[4][j] == 1 and self.gameBoard[5][j] == 1):
-                self.player1Score += 1
-            # Check player 2
-            if (self.gameBoard[0][j] == 2 and self.gameBoard[1][j] == 2 and
-                   self.gameBoard[2][j] == 2 and self.gameBoard[3][j] == 2):
-                self.player2Score += 1
-            if (self.gameBoard[1][j] == 2 and self.gameBoard[2][j] == 2 and
-                   self.gameBoard[3][j] == 2 and self.gameBoard[4][j] == 2):
-                self.player2Score += 1
-            if (self.gameBoard[2][j] == 2 and self.gameBoard[3][j] == 2 and
-                   self.gameBoard[4][j] == 2 and self.gameBoard[5][j] == 2):
-                self.player2Score += 1
-
-        # Check diagonally
-
-        # Check player 1
-        if (self.gameBoard[2][0] == 1 and self.gameBoard[3][1] == 1 and
-               self.gameBoard[4][2] == 1 and self.gameBoard[5][3] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[1][0] == 1 and self.gameBoard[2][1] == 1 and
-               self.gameBoard[3][2] == 1 and self.gameBoard[4][3] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[2][1] == 1 and self.gameBoard[3][2] == 1 and
-               self.gameBoard[4][3] == 1 and self.gameBoard[5][4] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[0][0] == 1 and self.gameBoard[1][1] == 1 and
-               self.gameBoard[2][2] == 1 and self.gameBoard[3][3] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[1][1] == 1 and self.gameBoard[2][2] == 1 and
-               self.gameBoard[3][3] == 1 and self.gameBoard[4][4] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[2][2] == 1 and self.gameBoard[3][3] == 1 and
-               self.gameBoard[4][4] == 1 and self.gameBoard[5][5] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[0][1] == 1 and self.gameBoard[1][2] == 1 and
-               self.gameBoard[2][3] == 1 and self.gameBoard[3][4] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[1][2] == 1 and self.gameBoard[2][3] == 1 and
-               self.gameBoard[3][4] == 1 and self.gameBoard[4][5] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[2][3] == 1 and self.gameBoard[3][4] == 1 and
-               self.gameBoard[4][5] == 1 and self.gameBoard[5][6] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[0][2] == 1 and self.gameBoard[1][3] == 1 and
-               self.gameBoard[2][4] == 1 and self.gameBoard[3][5] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[1][3] == 1 and self.gameBoard[2][4] == 1 and
-               self.gameBoard[3][5] == 1 and self.gameBoard[4][6] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[0][3] == 1 and self.gameBoard[1][4] == 1 and
-               self.gameBoard[2][5] == 1 and self.gameBoard[3][6] == 1):
-            self.player1Score += 1
-
-        if (self.gameBoard[0][3] == 1 and self.gameBoard[1][2] == 1 and
-               self.gameBoard[2][1] == 1 and self.gameBoard[3][0] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[0][4] == 1 and self.gameBoard[1][3] == 1 and
-               self.gameBoard[2][2] == 1 and self.gameBoard[3][1] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[1][3] == 1 and self.gameBoard[2][2] == 1 and
-               self.gameBoard[3][1] == 1 and self.gameBoard[4][0] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[0][5] == 1 and self.gameBoard[1][4] == 1 and
-               self.gameBoard[2][3] == 1 and self.gameBoard[3][2] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[1][4] == 1 and self.gameBoard[2][3] == 1 and
-               self.gameBoard[3][2] == 1 and self.gameBoard[4][1] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[2][3] == 1 and self.gameBoard[3][2] == 1 and
-               self.gameBoard[4][1] == 1 and self.gameBoard[5][0] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[0][6] == 1 and self.gameBoard[1][5] == 1 and
-               self.gameBoard[2][4] == 1 and self.gameBoard[3][3] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[1][5] == 1 and self.gameBoard[2][4] == 1 and
-               self.gameBoard[3][3] == 1 and self.gameBoard[4][2] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[2][4] == 1 and self.gameBoard[3][3] == 1 and
-               self.gameBoard[4][2] == 1 and self.gameBoard[5][1] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[1][6] == 1 and self.gameBoard[2][5] == 1 and
-               self.gameBoard[3][4] == 1 and self.gameBoard[4][3] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[2][5] == 1 and self.gameBoard[3][4] == 1 and
-               self.gameBoard[4][3] == 1 and self.gameBoard[5][2] == 1):
-            self.player1Score += 1
-        if (self.gameBoard[2][6] == 1 and self.gameBoard[3][5] == 1 and
-               self.gameBoard[4][4] == 1 and self.gameBoard[5][3] == 1):
-            self.player1Score += 1
-
-        # Check player 2
-        if (self.gameBoard[2][0] == 2 and self.gameBoard[3][1] == 2 and
-               self.gameBoard[4][2] == 2 and self.gameBoard[5][3] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[1][0] == 2 and self.gameBoard[2][1] == 2 and
-               self.gameBoard[3][2] == 2 and self.gameBoard[4][3] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[2][1] == 2 and self.gameBoard[3][2] == 2 and
-               self.gameBoard[4][3] == 2 and self.gameBoard[5][4] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[0][0] == 2 and self.gameBoard[1][1] == 2 and
-               self.gameBoard[2][2] == 2 and self.gameBoard[3][3] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[1][1] == 2 and self.gameBoard[2][2] == 2 and
-               self.gameBoard[3][3] == 2 and self.gameBoard[4][4] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[2][2] == 2 and self.gameBoard[3][3] == 2 and
-               self.gameBoard[4][4] == 2 and self.gameBoard[5][5] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[0][1] == 2 and self.gameBoard[1][2] == 2 and
-               self.gameBoard[2][3] == 2 and self.gameBoard[3][4] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[1][2] == 2 and self.gameBoard[2][3] == 2 and
-               self.gameBoard[3][4] == 2 and self.gameBoard[4][5] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[2][3] == 2 and self.gameBoard[3][4] == 2 and
-               self.gameBoard[4][5] == 2 and self.gameBoard[5][6] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[0][2] == 2 and self.gameBoard[1][3] == 2 and
-               self.gameBoard[2][4] == 2 and self.gameBoard[3][5] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[1][3] == 2 and self.gameBoard[2][4] == 2 and
-               self.gameBoard[3][5] == 2 and self.gameBoard[4][6] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[0][3] == 2 and self.gameBoard[1][4] == 2 and
-               self.gameBoard[2][5] == 2 and self.gameBoard[3][6] == 2):
-            self.player2Score += 1
-
-        if (self.gameBoard[0][3] == 2 and self.gameBoard[1][2] == 2 and
-               self.gameBoard[2][1] == 2 and self.gameBoard[3][0] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[0][4] == 2 and self.gameBoard[1][3] == 2 and
-               self.gameBoard[2][2] == 2 and self.gameBoard[3][1] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[1][3] == 2 and self.gameBoard[2][2] == 2 and
-               self.gameBoard[3][1] == 2 and self.gameBoard[4][0] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[0][5] == 2 and self.gameBoard[1][4] == 2 and
-               self.gameBoard[2][3] == 2 and self.gameBoard[3][2] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[1][4] == 2 and self.gameBoard[2][3] == 2 and
-               self.gameBoard[3][2] == 2 and self.gameBoard[4][1] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[2][3] == 2 and self.gameBoard[3][2] == 2 and
-               self.gameBoard[4][1] == 2 and self.gameBoard[5][0] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[0][6] == 2 and self.gameBoard[1][5] == 2 and
-               self.gameBoard[2][4] == 2 and self.gameBoard[3][3] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[1][5] == 2 and self.gameBoard[2][4] == 2 and
-               self.gameBoard[3][3] == 2 and self.gameBoard[4][2] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[2][4] == 2 and self.gameBoard[3][3] == 2 and
-               self.gameBoard[4][2] == 2 and self.gameBoard[5][1] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[1][6] == 2 and self.gameBoard[2][5] == 2 and
-               self.gameBoard[3][4] == 2 and self.gameBoard[4][3] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[2][5] == 2 and self.gameBoard[3][4] == 2 and
-               self.gameBoard[4][3] == 2 and self.gameBoard[5][2] == 2):
-            self.player2Score += 1
-        if (self.gameBoard[2][6] == 2 and self.gameBoard[3][5] == 2 and
-               self.gameBoard[4][4] == 2 and self.gameBoard[5][3] == 2):
-            self.player2Score += 1
-
+        self.player1Score = self.position.countFours(1)
+        self.player2Score = self.position.countFours(2)
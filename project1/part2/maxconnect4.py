@@ -6,15 +6,18 @@
 
 import sys
 from MaxConnect4Game import *
+from maxconnect4_parallel import ParallelSearch
 import time
 
-def oneMoveGame(currentGame, depth):
+def oneMoveGame(currentGame, depth, timeMs=None):
     starttime= time.time()
     if currentGame.pieceCount == 42:    # Is the board full already?
         print('BOARD FULL\n\nGame Over!\n')
         sys.exit(0)
 
-    currentGame.aiPlay(depth) # Make a move (only random is implemented)
+    currentGame.aiPlay(depth, timeMs) # Make the minimax move
+    if timeMs is not None:
+        print('Searched to depth %d' % currentGame.searchedDepth)
 
     print ('Game state after move:')
     currentGame.printGameBoard()
@@ -27,14 +30,16 @@ def oneMoveGame(currentGame, depth):
     print("time", time.time() - starttime)
 
 
-def interactiveGame(currentGame, aiTurn, depth):
+def interactiveGame(currentGame, aiTurn, depth, timeMs=None):
     print ('Game state:')
     currentGame.printGameBoard()
 
     while(currentGame.pieceCount != 42):
         print(currentGame.pieceCount)
         if aiTurn:
-            currentGame.aiPlay(int(depth))
+            currentGame.aiPlay(int(depth), timeMs)
+            if timeMs is not None:
+                print('Searched to depth %d' % currentGame.searchedDepth)
             currentGame.gameFile = open("computer.txt", 'w')
             currentGame.printGameBoardToFile()
             currentGame.gameFile.close()
@@ -59,11 +64,47 @@ def interactiveGame(currentGame, aiTurn, depth):
         print('Score: Player 1 = %d, Player 2 = %d\n' % (currentGame.player1Score, currentGame.player2Score))
 
 def main(argv):
+    # --time-ms N searches iteratively deeper for N milliseconds a move,
+    # depth is then the deepest it may go
+    timeMs = None
+    if '--time-ms' in argv:
+        i = argv.index('--time-ms')
+        try:
+            timeMs = int(argv[i+1])
+        except (IndexError, ValueError):
+            sys.exit('--time-ms needs a number of milliseconds')
+        argv = argv[:i] + argv[i+2:]
+
+    # --batch-eval KIND scores the moves one above the search horizon in
+    # batches, KIND is python or numpy (python if numpy is not installed)
+    batchEval = None
+    if '--batch-eval' in argv:
+        i = argv.index('--batch-eval')
+        try:
+            batchEval = batchEvaluator(argv[i+1])
+        except IndexError:
+            sys.exit('--batch-eval needs one of %s' % ', '.join(BATCH_EVALUATORS))
+        except ValueError as error:
+            sys.exit(str(error))
+        if argv[i+1] == 'numpy' and numpy is None:
+            print('numpy is not installed, using the python batch evaluator')
+        argv = argv[:i] + argv[i+2:]
+
+    # --workers N splits the root moves of every search over N processes
+    workers = 1
+    if '--workers' in argv:
+        i = argv.index('--workers')
+        try:
+            workers = int(argv[i+1])
+        except (IndexError, ValueError):
+            sys.exit('--workers needs a number of processes')
+        argv = argv[:i] + argv[i+2:]
+
     # Make sure we have enough command-line arguments
     if len(argv) != 5:
         print ('Four command-line arguments are needed:')
-        print('Usage: %s interactive [input_file] [computer-next/human-next] [depth]' % argv[0])
-        print('or: %s one-move [input_file] [output_file] [depth]' % argv[0])
+        print('Usage: %s interactive [input_file] [computer-next/human-next] [depth] [--time-ms N] [--batch-eval KIND] [--workers N]' % argv[0])
+        print('or: %s one-move [input_file] [output_file] [depth] [--time-ms N] [--batch-eval KIND] [--workers N]' % argv[0])
         sys.exit(2)
 
     game_mode, inFile = argv[1:3]
@@ -73,7 +114,7 @@ def main(argv):
         print('%s is an unrecognized game mode' % game_mode)
         sys.exit(2)
 
-    currentGame = maxConnect4Game() # Create a game
+    currentGame = maxConnect4Game(batchEval=batchEval) # Create a game
 
     # Try to open the input file
     try:
@@ -81,10 +122,8 @@ def main(argv):
     except IOError:
         sys.exit("\nError opening input file.\nCheck file name.\n")
 
-    # Read the initial game state from the file and save in a 2D list
-    file_lines = currentGame.gameFile.readlines()
-    currentGame.gameBoard = [[int(char) for char in line[0:7]] for line in file_lines[0:-1]]
-    currentGame.currentTurn = int(file_lines[-1][0])
+    # Read the initial game state from the file into the bitboard
+    currentGame.readGameFile(currentGame.gameFile)
     currentGame.gameFile.close()
 
     print ('\nMaxConnect-4 game\n')
@@ -96,21 +135,28 @@ def main(argv):
     currentGame.countScore()
     print('Score: Player 1 = %d, Player 2 = %d\n' % (currentGame.player1Score, currentGame.player2Score))
 
-    aiTurn = False
-    if game_mode == 'interactive':
-        if argv[3] == "computer-next":
-            aiTurn = True
-        else:
-            aiTurn = False
-        interactiveGame(currentGame, aiTurn, depth) # Be sure to pass whatever else you need from the command line
-    else: # game_mode == 'one-move'
-        # Set up the output file
-        outFile = argv[3]
-        try:
-            currentGame.gameFile = open(outFile, 'w')
-        except:
-            sys.exit('Error opening output file.')
-        oneMoveGame(currentGame, int(depth)) # Be sure to pass any other arguments from the command line you might need.
+    if workers > 1:
+        currentGame.parallel = ParallelSearch(currentGame, workers)
+
+    try:
+        aiTurn = False
+        if game_mode == 'interactive':
+            if argv[3] == "computer-next":
+                aiTurn = True
+            else:
+                aiTurn = False
+            interactiveGame(currentGame, aiTurn, depth, timeMs) # Be sure to pass whatever else you need from the command line
+        else: # game_mode == 'one-move'
+            # Set up the output file
+            outFile = argv[3]
+            try:
+                currentGame.gameFile = open(outFile, 'w')
+            except:
+                sys.exit('Error opening output file.')
+            oneMoveGame(currentGame, int(depth), timeMs) # Be sure to pass any other arguments from the command line you might need.
+    finally:
+        if currentGame.parallel is not None:
+            currentGame.parallel.close()
 
 
 if __name__ == '__main__':
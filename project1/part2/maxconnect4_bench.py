@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from MaxConnect4Game import BATCH_EVALUATORS, batchEvaluator, maxConnect4Game
+from maxconnect4_parallel import ParallelSearch
+
+# Benchmarks the minimax search on game files: every file is searched to
+# every depth with move ordering off (columns left to right after the table
+# move) and on, each time on a fresh game so nothing carries over. Both
+# settings have to pick the same move, only the nodes searched may differ.
+# With --workers the ordered search is run with each number of worker
+# processes instead (1 is the serial search) and has to pick the serial move.
+
+# game files among the sample inputs (input1.txt is a route file)
+GAME_SAMPLES = ("input2.txt", "input11.txt")
+
+# searches one game file to one depth, returns the move, nodes and seconds
+def measure(file, depth, ordering, batchEval=None, workers=1):
+    game = maxConnect4Game(ordering=ordering, batchEval=batchEval)
+    with open(file, "r") as f:
+        game.readGameFile(f)
+    if workers > 1:
+        game.parallel = ParallelSearch(game, workers)
+    game.table.newSearch()
+    game.nodes = 0
+    begin = time.perf_counter()
+    column = game.minimax(depth)
+    seconds = time.perf_counter() - begin
+    if game.parallel is not None:
+        game.parallel.close()
+    return {"column": column, "nodes": game.nodes, "seconds": seconds}
+
+# runs the ordered search of one file and depth with every worker count
+def measureWorkers(file, depth, batchEval, workerCounts):
+    runs = dict()
+    for workers in workerCounts:
+        runs[workers] = measure(file, depth, True, batchEval, workers)
+    serial = runs[workerCounts[0]]
+    print("{0:12} depth {1:2}  ".format(os.path.basename(file), depth) + "  ".join(
+        "{0} workers {1:8.3f}s x{2:.2f}{3}".format(workers, run["seconds"], serial["seconds"] / run["seconds"],
+                                                  "" if run["column"] == serial["column"] else " DIFFERENT MOVE")
+        for workers, run in runs.items()))
+    return runs
+
+def main(argv):
+    samples = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample_inputs")
+    parser = argparse.ArgumentParser(prog="maxconnect4_bench.py", description="benchmark the minimax move ordering")
+    parser.add_argument("files", nargs="*", help="game files, default the sample inputs")
+    parser.add_argument("--depths", default="4,6,8", help="comma separated search depths")
+    parser.add_argument("--batch-eval", default=None, choices=BATCH_EVALUATORS,
+                        help="score the moves above the horizon in batches")
+    parser.add_argument("--workers", default=None,
+                        help="comma separated worker counts to compare, e.g. 1,2,4,8")
+    parser.add_argument("--out", default=None, help="results file (json)")
+    args = parser.parse_args(argv[1:])
+
+    batchEval = batchEvaluator(args.batch_eval) if args.batch_eval else None
+    files = args.files or [os.path.join(samples, name) for name in GAME_SAMPLES]
+    results = {"python": platform.python_version(), "cpus": os.cpu_count(), "batch_eval": args.batch_eval, "runs": list()}
+    workerCounts = None
+    if args.workers:
+        workerCounts = [int(workers) for workers in args.workers.split(",")]
+        # workers sharing a core take turns, so such runs say nothing about scaling
+        if max(workerCounts) > (os.cpu_count() or 1):
+            sys.stderr.write("warning: {0} cpus, worker counts above that measure overhead, not scaling\n".format(
+                os.cpu_count()))
+    same = True
+    for file in files:
+        for depth in [int(depth) for depth in args.depths.split(",")]:
+            if args.workers:
+                runs = measureWorkers(file, depth, batchEval, workerCounts)
+                same = same and len(set(run["column"] for run in runs.values())) == 1
+                results["runs"].append({"file": os.path.basename(file), "depth": depth,
+                                        "workers": dict((str(workers), run) for workers, run in runs.items())})
+                continue
+            plain = measure(file, depth, False, batchEval)
+            ordered = measure(file, depth, True, batchEval)
+            same = same and plain["column"] == ordered["column"]
+            results["runs"].append({"file": os.path.basename(file), "depth": depth,
+                                    "plain": plain, "ordered": ordered})
+            print("{0:12} depth {1:2}  plain {2:9} nodes {3:8.3f}s  ordered {4:9} nodes {5:8.3f}s  column {6} {7}".format(
+                os.path.basename(file), depth, plain["nodes"], plain["seconds"], ordered["nodes"],
+                ordered["seconds"], ordered["column"], "" if plain["column"] == ordered["column"] else "DIFFERENT MOVE"))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+    if not same:
+        sys.exit("a move differs from the serial move" if args.workers else "move ordering changed a move")
+
+if __name__ == "__main__":
+    main(sys.argv)
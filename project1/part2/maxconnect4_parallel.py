@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import multiprocessing
+
+from MaxConnect4Game import EXACT, INFINITY, TURN_KEYS, SearchTimeout, maxConnect4Game
+
+# Root splitting: every move of the root is searched by a worker process of
+# a pool. The workers share the best root value found so far, a worker
+# starting on a move searches it with alpha one below that value (values
+# are whole numbers), so a move as good as the best comes back exact and the
+# leftmost of equally good moves is played, as in the serial search. Worse
+# moves are cut off as soon as a good one is known. Every worker keeps its
+# own game and transposition table for as long as the pool lives.
+
+# the game a worker process searches on, the shared best root value and the
+# search (transposition table generation of the parent) it last worked for
+_game = None
+_best = None
+_search = None
+
+# makes the game of one worker process, set up like the parent's
+def _initWorker(best, tableSize, ordering, batchEval):
+    global _game, _best
+    _best = best
+    _game = maxConnect4Game(tableSize, ordering, batchEval)
+
+# searches one root move, returns the column, its value (None if the search
+# ran out of time) and the nodes searched
+def _searchColumn(task):
+    global _search
+    rows, turn, column, depth, search, deadline = task
+    game = _game
+    if search != _search:
+        game.table.newSearch()
+        game.newOrdering()
+        _search = search
+    game.gameBoard = rows
+    game.currentTurn = turn
+    game.nodes = 0
+    game.deadline = deadline
+    alpha = _best.value - 1
+    try:
+        game.position.play(column, turn)
+        if depth > 1:
+            value = game.minPlayer(alpha, INFINITY, depth-2)[0]
+        else:
+            game.countNode()
+            value = game.heuristic()
+    except SearchTimeout:
+        return column, None, game.nodes
+    finally:
+        game.deadline = None
+
+    with _best.get_lock():
+        if value > _best.value:
+            _best.value = value
+    return column, value, game.nodes
+
+# a pool of workers searching the root moves of a game's searches, see
+# maxConnect4Game.minimax. Close it when the game is over.
+class ParallelSearch:
+    def __init__(self, game, workers):
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        self.workers = workers
+        self.best = context.Value("d", -INFINITY)
+        self.pool = context.Pool(workers, _initWorker, (self.best, game.table.size, game.ordering, game.batchEval))
+
+    # the move to play, searching depth moves ahead. The moves are handed
+    # out best first (table move, then the game's move ordering) so a good
+    # value is shared early. Raises SearchTimeout if a worker ran out of time.
+    def minimax(self, game, depth):
+        position = game.position
+        turn = game.currentTurn
+        key = position.hash ^ TURN_KEYS[turn][turn]
+        game.countNode()
+        columns = game.orderColumns(game.table.probe(key), turn)
+        if not columns:
+            return None
+
+        self.best.value = -INFINITY
+        rows = position.rows()
+        tasks = [(rows, turn, column, depth, game.table.generation, game.deadline) for column in columns]
+        val = -INFINITY
+        maxCol = None
+        timedOut = False
+        for column, value, nodes in self.pool.imap_unordered(_searchColumn, tasks):
+            game.nodes += nodes
+            if value is None:
+                timedOut = True
+            elif value > val or (value == val and column < maxCol):
+                val = value
+                maxCol = column
+        if timedOut:
+            raise SearchTimeout()
+
+        game.table.store(key, depth-1, val, EXACT, maxCol)
+        return maxCol
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()